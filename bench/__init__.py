@@ -0,0 +1,21 @@
+import os
+
+from configparser import ConfigParser
+
+from utils.config import Config
+
+CONFIG_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.ini")
+
+
+def make_config(cache_server, overrides=None):
+    ''' Config from config.ini pointed at a local cache server. overrides
+    are (section, option) -> value pairs, e.g.
+    {("LOCAL PROPERTIES", "THREADCOUNT"): 4}. '''
+    cparser = ConfigParser()
+    cparser.read(CONFIG_FILE)
+    for (section, option), value in (overrides or dict()).items():
+        cparser[section][option] = str(value)
+    config = Config(cparser)
+    config.cache_server = cache_server
+    return config
@@ -0,0 +1,216 @@
+''' Recorded cache server responses, for replaying a crawl offline.
+
+A corpus file is a sequence of records, each the 4-byte big-endian length
+of a payload followed by the payload: the cbor body the cache server sent
+for one url ({"url", "status", "response": pickled requests.Response}),
+byte for byte, so utils.download reads a replayed page exactly like a live
+one. The first record is the seed of the crawl that was recorded.
+
+    python3 launch.py --record_corpus corpus.bin
+    python -m bench.corpus synthesize corpus.bin --pages 2000
+
+record a live crawl through a RecordingProxy, or write a synthetic corpus of
+linked pages when the cache server cannot be reached (e.g. in CI). '''
+import time
+import pickle
+import random
+import struct
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+
+import cbor
+import requests
+
+from bench.stub_server import make_raw_response
+from utils.download import record_download
+from utils.response import Response
+
+LENGTH = struct.Struct(">I")
+
+
+class CorpusWriter(object):
+    ''' Appends payloads to the corpus file at path, or starts it over
+    unless append is set. '''
+    def __init__(self, path, append=True):
+        self.file = open(path, "ab" if append else "wb")
+        self.lock = Lock()
+        self.count = 0
+
+    def add(self, payload):
+        with self.lock:
+            self.file.write(LENGTH.pack(len(payload)) + payload)
+            self.count += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Corpus(object):
+    ''' The payloads of a corpus file, by url, in recording order. Only the
+    first limit records are read when limit is given. '''
+    def __init__(self, path, limit=None):
+        self.payloads = dict()
+        with open(path, "rb") as file:
+            while limit is None or len(self.payloads) < limit:
+                header = file.read(LENGTH.size)
+                if len(header) < LENGTH.size:
+                    break
+                payload = file.read(LENGTH.unpack(header)[0])
+                url = cbor.loads(payload)["url"]
+                self.payloads.setdefault(url, payload)
+        self.urls = list(self.payloads)
+
+    def __len__(self):
+        return len(self.payloads)
+
+    def __contains__(self, url):
+        return url in self.payloads
+
+    @property
+    def seed(self):
+        return self.urls[0]
+
+    def payload(self, url):
+        ''' The recorded cbor body for url, or a 404 like the cache server
+        passes on for a page that does not exist. '''
+        payload = self.payloads.get(url)
+        if payload is None:
+            payload = cbor.dumps({
+                "url": url, "status": 404,
+                "response": pickle.dumps(make_raw_response(url, b"", 404))})
+        return payload
+
+    def response(self, url):
+        return Response(cbor.loads(self.payload(url)))
+
+    def download(self, url, config=None, logger=None):
+        ''' Drop-in for utils.download.download that answers from the
+        corpus without any HTTP. '''
+        start = time.perf_counter()
+        resp = self.response(url)
+        record_download(resp, time.perf_counter() - start)
+        return resp
+
+
+class RecordingProxy(object):
+    ''' Local cache server that forwards every request to upstream (the
+    real cache server's (host, port)) and appends the body it gets back to
+    the corpus file at path. Point config.cache_server at address. '''
+    def __init__(self, upstream, path, host="127.0.0.1", port=0):
+        self.writer = CorpusWriter(path)
+        session = requests.Session()
+        writer = self.writer
+        upstream_url = f"http://{upstream[0]}:{upstream[1]}"
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                try:
+                    resp = session.get(upstream_url + self.path, timeout=60)
+                except requests.RequestException:
+                    self.send_error(502)
+                    return
+                body = resp.content
+                if resp.status_code == 200:
+                    writer.add(body)
+                self.send_response(resp.status_code)
+                self.send_header("Content-Type", "application/cbor")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address[:2]
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.writer.close()
+
+
+HOSTS = ["www.ics.uci.edu", "www.cs.uci.edu", "www.informatics.uci.edu",
+         "www.stat.uci.edu", "vision.ics.uci.edu", "ngs.ics.uci.edu"]
+SECTIONS = ["people", "research", "news", "courses", "events", "projects"]
+
+
+def _slug(number):
+    # Letters only, so that the trap detector's url templates, which turn
+    # digits into #, do not lump every page together.
+    letters = ""
+    while True:
+        number, digit = divmod(number, 26)
+        letters += chr(ord("a") + digit)
+        if not number:
+            return letters
+
+
+def synthetic_url(number):
+    return (f"https://{HOSTS[number % len(HOSTS)]}/"
+            f"{SECTIONS[number // len(HOSTS) % len(SECTIONS)]}/"
+            f"{_slug(number)}")
+
+
+def synthesize(path, pages, links=20, words=400, seed=0):
+    ''' Writes a corpus of pages numbered 0 to pages - 1 on a few uci.edu
+    hosts, each with links to other pages of the corpus and text drawn
+    from a skewed vocabulary, like real pages. Some words are not ASCII,
+    and the pages are UTF-8 with the charset in neither the header nor a
+    <meta> tag, as many real pages are. '''
+    rng = random.Random(seed)
+    vocabulary = [_slug(number) + ("x" if number % 7 else "é")
+                  for number in range(5000)]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    with CorpusWriter(path, append=False) as writer:
+        for number in range(pages):
+            url = synthetic_url(number)
+            anchors = "".join(
+                f'<li><a href="{synthetic_url(rng.randrange(pages))}">'
+                f'link</a></li>' for _ in range(links))
+            text = " ".join(rng.choices(vocabulary, weights, k=words))
+            content = (
+                f"<html><head><title>{url}</title></head><body>"
+                f"<nav><ul>{anchors}</ul></nav><p>{text}</p>"
+                f"</body></html>").encode("utf-8")
+            writer.add(cbor.dumps({
+                "url": url, "status": 200,
+                "response": pickle.dumps(make_raw_response(url, content))}))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    synthesize_parser = commands.add_parser(
+        "synthesize", help="Write a synthetic corpus.")
+    synthesize_parser.add_argument("path")
+    synthesize_parser.add_argument("--pages", type=int, default=2000)
+    synthesize_parser.add_argument("--links", type=int, default=20)
+    synthesize_parser.add_argument("--words", type=int, default=400)
+    synthesize_parser.add_argument("--seed", type=int, default=0)
+    info_parser = commands.add_parser("info", help="Describe a corpus.")
+    info_parser.add_argument("path")
+    args = parser.parse_args()
+    if args.command == "synthesize":
+        synthesize(args.path, args.pages, args.links, args.words, args.seed)
+    corpus = Corpus(args.path)
+    size = sum(len(payload) for payload in corpus.payloads.values())
+    print(f"{args.path}: {len(corpus)} pages, {size / 1e6:.1f} MB, "
+          f"seed {corpus.seed}")
@@ -0,0 +1,75 @@
+''' Download throughput against a local stub cache server.
+
+    python -m bench.download_throughput --urls 2000 --latency 0.005
+
+Compares a bare requests.get per url (the old utils.download), the pooled
+session used by utils.download.download from THREADCOUNT threads, and
+utils.async_download.AsyncDownloader with CONCURRENCY requests in flight.
+'''
+import asyncio
+import time
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+import cbor
+import requests
+
+from bench import make_config
+from bench.stub_server import StubCacheServer
+from utils.async_download import AsyncDownloader
+from utils.download import download
+from utils.response import Response
+
+
+def bare_download(url, config):
+    host, port = config.cache_server
+    resp = requests.get(
+        f"http://{host}:{port}/",
+        params=[("q", f"{url}"), ("u", f"{config.user_agent}")])
+    return Response(cbor.loads(resp.content))
+
+
+def run_threads(fetch, urls, config, threads):
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(lambda url: fetch(url, config), urls))
+
+
+async def run_async(urls, config):
+    async with AsyncDownloader(config) as downloader:
+        return await asyncio.gather(*(downloader.download(url) for url in urls))
+
+
+def measure(name, run, count):
+    start = time.perf_counter()
+    responses = run()
+    elapsed = time.perf_counter() - start
+    assert len(responses) == count and all(r.status == 200 for r in responses)
+    print(f"{name:<32} {count / elapsed:10.1f} pages/sec")
+
+
+def main(count, threads, concurrency, latency):
+    urls = [f"https://www.ics.uci.edu/page/{i}" for i in range(count)]
+    with StubCacheServer(latency=latency) as server:
+        config = make_config(server.address, {
+            ("LOCAL PROPERTIES", "THREADCOUNT"): threads,
+            ("LOCAL PROPERTIES", "CONCURRENCY"): concurrency})
+        measure(f"requests.get x{threads} threads",
+                lambda: run_threads(bare_download, urls, config, threads),
+                count)
+        measure(f"pooled session x{threads} threads",
+                lambda: run_threads(download, urls, config, threads), count)
+        measure(f"async x{concurrency} in flight",
+                lambda: asyncio.run(run_async(urls, config)), count)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--urls", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--latency", type=float, default=0.0,
+        help="Seconds the stub server waits before answering.")
+    args = parser.parse_args()
+    main(args.urls, args.threads, args.concurrency, args.latency)
@@ -0,0 +1,97 @@
+''' Page extraction throughput on the pages of a corpus.
+
+    python -m bench.extract corpus.bin --repeat 3
+
+Compares the old scraper, which parsed every page with BeautifulSoup and
+walked the parents of every content tag, with utils.extract on lxml and on
+html.parser. Every method gets the same bytes, and utils.extract the
+charset of the Content-Type header too, as in the crawl; the old path is
+skipped when bs4 is not installed. Reports how many pages disagree with the
+old path on their links or on the set of their tokens. '''
+import time
+
+from argparse import ArgumentParser
+from unittest import mock
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+import utils.extract
+from bench.corpus import Corpus
+from utils.extract import extract, Page, CONTENT_TAGS, BOILERPLATE_TAGS
+from utils.tokenizer import Tokenizer
+
+tokenize = Tokenizer().tokenize
+
+
+def legacy_extract(content, tokenize, encoding=None):
+    # scraper.extract_next_links before utils.extract, which left the
+    # encoding to BeautifulSoup
+    soup = BeautifulSoup(content, "html.parser")
+    filtered_tags = soup.find_all(
+        lambda tag: tag.name in CONTENT_TAGS and not any(
+            parent.name in BOILERPLATE_TAGS for parent in tag.parents))
+    text = " ".join([tag.get_text() for tag in filtered_tags])
+    links = [tag.get("href") for tag in soup.find_all("a", href=True)]
+    return Page(text, links, tokenize(text))
+
+
+def stdlib_extract(content, tokenize, encoding=None):
+    # utils.extract as it runs when lxml is not installed
+    with mock.patch.object(utils.extract, "etree", None):
+        return extract(content, tokenize, encoding)
+
+
+def measure(name, run, contents, charsets, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pages = [run(content, tokenize, charset)
+                 for content, charset in zip(contents, charsets)]
+        best = min(best, time.perf_counter() - start)
+    size = sum(len(content) for content in contents)
+    print(f"{name:<24} {len(contents) / best:10.1f} pages/sec "
+          f"{size / best / 1e6:8.2f} MB/sec")
+    return pages
+
+
+def disagreements(pages, expected):
+    return sum(
+        page.links != old.links or set(page.tokens) != set(old.tokens)
+        for page, old in zip(pages, expected))
+
+
+def main(path, pages, repeat):
+    corpus = Corpus(path, pages)
+    responses = [corpus.response(url) for url in corpus.urls]
+    contents = [resp.raw_response.content for resp in responses]
+    charsets = [resp.charset for resp in responses]
+    print(f"{len(contents)} pages, "
+          f"{sum(len(content) for content in contents) / 1e6:.1f} MB, "
+          f"lxml {'installed' if utils.extract.etree is not None else 'not installed'}")
+    expected = None
+    if BeautifulSoup is not None:
+        expected = measure("beautifulsoup find_all", legacy_extract,
+                           contents, charsets, repeat)
+    results = list()
+    if utils.extract.etree is not None:
+        results.append(("extract, lxml", measure(
+            "extract, lxml", extract, contents, charsets, repeat)))
+    results.append(("extract, html.parser", measure(
+        "extract, html.parser", stdlib_extract, contents, charsets,
+        repeat)))
+    if expected is not None:
+        for name, pages in results:
+            print(f"{name}: {disagreements(pages, expected)} pages differ "
+                  f"from beautifulsoup in links or token sets")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("corpus")
+    parser.add_argument("--pages", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    main(args.corpus, args.pages, args.repeat)
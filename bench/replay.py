@@ -0,0 +1,257 @@
+''' Crawler, Frontier and scraper throughput replayed from a corpus.
+
+    python -m bench.corpus synthesize /tmp/corpus.bin --pages 2000
+    python -m bench.replay /tmp/corpus.bin --threads 1,4 --pages 500,2000
+
+Every benchmark runs in a fresh process, once per thread count and corpus
+size (the first --pages records of the corpus), and reports pages per
+second, the mean and 95th percentile of each stage from utils.metrics, and
+the peak RSS of the process:
+
+    crawler   a full Crawler crawl from the corpus seed, served by a
+              StubCacheServer (--transport server) or by Corpus.download in
+              place of utils.download (--transport shim)
+    frontier  add_url for every corpus url, then get_tbd_url and
+              mark_url_complete until the frontier is empty
+    scraper   scraper.scraper on every corpus page
+
+--json writes the results, and --baseline compares them with an earlier
+--json file, failing when pages per second dropped by more than
+--tolerance, for use in CI. '''
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import tempfile
+import resource
+import traceback
+import multiprocessing
+
+from argparse import ArgumentParser
+from threading import Thread
+
+BENCHMARKS = ("crawler", "frontier", "scraper")
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def stage_timings():
+    ''' Mean and 95th percentile in milliseconds of every time histogram
+    in utils.metrics. '''
+    from utils import metrics
+    timings = dict()
+    for name, (metric, values) in metrics.REGISTRY.collect().items():
+        if metric.kind == "histogram" and name.endswith("_seconds"):
+            count = values["count"]
+            timings[name[:-len("_seconds")]] = {
+                "count": count,
+                "mean_ms": 1000 * values["sum"] / count if count else 0,
+                "p95_ms": 1000 * metric.quantile(0.95)}
+    return timings
+
+
+def bench_config(cache_server, threads, corpus, politeness):
+    from bench import make_config
+    return make_config(cache_server, {
+        ("IDENTIFICATION", "USERAGENT"): "IR bench",
+        ("LOCAL PROPERTIES", "THREADCOUNT"): threads,
+        ("LOCAL PROPERTIES", "SAVE"): "bench.db",
+        ("LOCAL PROPERTIES", "STATSINTERVAL"): 3600,
+        ("CRAWLER", "SEEDURL"): corpus.seed,
+        ("CRAWLER", "POLITENESS"): politeness})
+
+
+def run_crawler(corpus, threads, transport, politeness):
+    from bench.stub_server import StubCacheServer
+    from crawler import Crawler
+    import crawler.worker
+
+    if transport == "shim":
+        crawler.worker.download = corpus.download
+        server = None
+        address = ("127.0.0.1", 0)
+    else:
+        server = StubCacheServer(corpus=corpus).start()
+        address = server.address
+    try:
+        config = bench_config(address, threads, corpus, politeness)
+        crawl = Crawler(config, True)
+        start = time.perf_counter()
+        crawl.start()
+        elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.stop()
+    return crawl.frontier.completed_count, elapsed
+
+
+def run_frontier(corpus, threads, politeness):
+    from crawler.frontier import Frontier
+
+    config = bench_config(("127.0.0.1", 0), threads, corpus, politeness)
+    frontier = Frontier(config, True)
+    start = time.perf_counter()
+    for url in corpus.urls:
+        frontier.add_url(url)
+
+    def drain():
+        while True:
+            url = frontier.get_tbd_url()
+            if not url:
+                break
+            frontier.mark_url_complete(url)
+
+    workers = [Thread(target=drain) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    frontier.close()
+    return frontier.completed_count, elapsed
+
+
+def run_scraper(corpus, threads):
+    import scraper
+
+    responses = [(url, corpus.response(url)) for url in corpus.urls]
+    chunks = [responses[i::threads] for i in range(threads)]
+
+    def scrape(chunk):
+        for url, resp in chunk:
+            scraper.scraper(url, resp)
+
+    workers = [Thread(target=scrape, args=(chunk,)) for chunk in chunks]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    scraper.state.close()
+    return len(responses), elapsed
+
+
+def _run(benchmark, corpus_path, pages, threads, transport, politeness,
+         results):
+    # A process of its own per run, so that peak RSS and the metrics are
+    # those of this run only, and files land in a scratch directory. The
+    # crawler still logs every page, but to nowhere.
+    sys.stderr = open(os.devnull, "w")
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.chdir(workdir)
+    try:
+        from bench.corpus import Corpus
+        corpus = Corpus(corpus_path, pages)
+        if benchmark == "crawler":
+            done, elapsed = run_crawler(corpus, threads, transport, politeness)
+        elif benchmark == "frontier":
+            done, elapsed = run_frontier(corpus, threads, politeness)
+        else:
+            done, elapsed = run_scraper(corpus, threads)
+        results.put({
+            "benchmark": benchmark, "corpus_pages": len(corpus),
+            "threads": threads,
+            "transport": transport if benchmark == "crawler" else None,
+            "pages": done, "seconds": elapsed,
+            "pages_per_sec": done / elapsed if elapsed else 0,
+            "stages": stage_timings(), "peak_rss_mb": peak_rss_mb()})
+    except Exception:
+        results.put({"error": traceback.format_exc()})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run(benchmark, corpus_path, pages, threads, transport="server",
+        politeness=0):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run, args=(
+        benchmark, os.path.abspath(corpus_path), pages, threads, transport,
+        politeness, results))
+    process.start()
+    while True:
+        try:
+            result = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(
+                    f"The {benchmark} benchmark exited with code "
+                    f"{process.exitcode}.")
+    process.join()
+    if "error" in result:
+        raise RuntimeError(
+            f"The {benchmark} benchmark failed:\n{result['error']}")
+    return result
+
+
+def describe(result):
+    stages = ", ".join(
+        f"{name} {timing['mean_ms']:.2f}/{timing['p95_ms']:g} ms"
+        for name, timing in sorted(result["stages"].items())
+        if timing["count"])
+    return (f"{result['benchmark']:<9} {result['corpus_pages']:>7} pages "
+            f"x{result['threads']:<3} {result['pages_per_sec']:>9.1f} pages/s "
+            f"{result['peak_rss_mb']:>7.1f} MB  {stages}")
+
+
+def regressions(results, baseline, tolerance):
+    ''' Results that are more than tolerance slower than the same run in
+    baseline. '''
+    def key(result):
+        return (result["benchmark"], result["corpus_pages"],
+                result["threads"], result["transport"])
+    previous = {key(result): result for result in baseline}
+    return [
+        (result, previous[key(result)]) for result in results
+        if key(result) in previous and result["pages_per_sec"]
+        < (1 - tolerance) * previous[key(result)]["pages_per_sec"]]
+
+
+def main(args=None):
+    parser = ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("corpus")
+    parser.add_argument(
+        "--benchmarks", default=",".join(BENCHMARKS),
+        help="Comma separated, of " + ", ".join(BENCHMARKS) + ".")
+    parser.add_argument("--threads", default="1,4")
+    parser.add_argument(
+        "--pages", default="0", help="Corpus sizes, 0 for the whole corpus.")
+    parser.add_argument(
+        "--transport", choices=("server", "shim"), default="server")
+    parser.add_argument("--politeness", type=float, default=0)
+    parser.add_argument("--json", default=None)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(args)
+
+    results = list()
+    for benchmark in args.benchmarks.split(","):
+        for pages in map(int, args.pages.split(",")):
+            for threads in map(int, args.threads.split(",")):
+                result = run(benchmark, args.corpus, pages or None, threads,
+                             args.transport, args.politeness)
+                print(describe(result), flush=True)
+                results.append(result)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=1)
+    if args.baseline:
+        with open(args.baseline) as file:
+            slower = regressions(results, json.load(file), args.tolerance)
+        for result, previous in slower:
+            print(f"REGRESSION {describe(result)} "
+                  f"(was {previous['pages_per_sec']:.1f} pages/s)")
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
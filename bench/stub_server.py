@@ -0,0 +1,117 @@
+import pickle
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from urllib.parse import urlparse, parse_qs
+
+import cbor
+import requests
+
+
+def make_raw_response(url, content, status=200, content_type="text/html"):
+    ''' A requests.Response like the ones the cache server pickles into the
+    "response" field of its cbor payload. '''
+    raw = requests.models.Response()
+    raw.url = url
+    raw.status_code = status
+    raw.headers["Content-Type"] = content_type
+    raw.headers["Content-Length"] = str(len(content))
+    raw.encoding = "utf-8"
+    raw._content = content
+    return raw
+
+
+def synthetic_page(url, links=20, paragraphs=20):
+    ''' A page with some text and links to further synthetic pages on the
+    same host, for when there is no recorded page for url. '''
+    parsed = urlparse(url)
+    base = f"{parsed.scheme}://{parsed.netloc}"
+    seed = sum(url.encode("utf-8"))
+    anchors = "".join(
+        f'<li><a href="{base}/page/{(seed * 31 + i) % 100000}">page {i}</a></li>'
+        for i in range(links))
+    text = "".join(
+        f"<p>paragraph {i} of {url} about research software data {seed}</p>"
+        for i in range(paragraphs))
+    return (f"<html><head><title>{url}</title></head><body>"
+            f"<nav><ul>{anchors}</ul></nav>{text}</body></html>").encode("utf-8")
+
+
+class StubCacheServer(object):
+    ''' Local stand-in for the spacetime cache server. Answers
+    GET /?q=<url>&u=<user agent> with the same cbor payload the real server
+    sends, so utils.download and the crawler work against it unchanged.
+
+    pages maps a url to (status, content bytes); urls not in pages get a
+    synthetic page. With a corpus (bench/corpus.py), its recorded payloads
+    are replayed instead, and urls it does not have get a 404. latency adds
+    a fixed delay to every request.
+
+        with StubCacheServer() as server:
+            config.cache_server = server.address
+    '''
+    def __init__(self, pages=None, host="127.0.0.1", port=0, latency=0,
+                 corpus=None):
+        self.pages = pages if pages is not None else dict()
+        self.corpus = corpus
+        self.latency = latency
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; without this,
+            # Nagle and delayed acks stall every keep-alive response.
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                url = query.get("q", [""])[0]
+                stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                body = stub.payload(url)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/cbor")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up on the body, e.g. it was too large.
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address[:2]
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    def payload(self, url):
+        if self.corpus is not None:
+            return self.corpus.payload(url)
+        if url in self.pages:
+            status, content = self.pages[url]
+        else:
+            status, content = 200, synthetic_page(url)
+        return cbor.dumps({
+            "url": url,
+            "status": status,
+            "response": pickle.dumps(make_raw_response(url, content, status))})
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,100 @@
+''' Tokenizing and word counting throughput on the pages of a corpus.
+
+    python -m bench.tokenizer corpus.bin --repeat 3
+
+Compares the old scraper, which tested every token against the stop word
+list, with utils.tokenizer: count_words as the crawl uses it, and the
+interned vocabulary one page at a time and in batches (NumPy is used for the
+batches when it is installed). The page text is extracted once up
+front, so only tokenizing and counting are timed; every method must give
+the same word counts. '''
+import time
+
+from argparse import ArgumentParser
+from collections import Counter
+
+from bench.corpus import Corpus
+from utils.extract import extract
+from utils.tokenizer import Tokenizer, TOKEN_PATTERN, numpy
+from scraper import stop_words
+
+
+def list_counts(texts):
+    # scraper.extract_next_links before utils.tokenizer
+    results = list()
+    for text in texts:
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        results.append(
+            Counter(word for word in tokens if word.lower() not in stop_words))
+    return results
+
+
+def word_counts(texts, tokenizer):
+    return [tokenizer.count_words(tokenizer.tokenize(text)) for text in texts]
+
+
+def page_counts(texts, tokenizer):
+    return [tokenizer.count(tokenizer.encode(tokenizer.tokenize(text)))
+            for text in texts]
+
+
+def batch_counts(texts, tokenizer, batch_size):
+    results = list()
+    for start in range(0, len(texts), batch_size):
+        results.extend(tokenizer.count_batch(
+            tokenizer.encode_batch(texts[start:start + batch_size])))
+    return results
+
+
+def measure(name, run, texts, tokens, repeat, expected):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = run()
+        best = min(best, time.perf_counter() - start)
+    assert results == expected, f"{name} counted different words"
+    print(f"{name:<28} {len(texts) / best:10.1f} pages/sec "
+          f"{tokens / best / 1e6:8.2f} M tokens/sec")
+
+
+def main(path, pages, repeat, batch_size):
+    corpus = Corpus(path, pages)
+    texts = [extract(corpus.response(url).raw_response.content,
+                     lambda text: ()).text for url in corpus.urls]
+    tokens = sum(len(TOKEN_PATTERN.findall(text)) for text in texts)
+    print(f"{len(texts)} pages, {tokens} tokens, "
+          f"numpy {'installed' if numpy is not None else 'not installed'}")
+    expected = list_counts(texts)
+    measure("stop word list", lambda: list_counts(texts), texts, tokens,
+            repeat, expected)
+    tokenizer = Tokenizer(stop_words)
+    measure("tokenizer, count_words", lambda: word_counts(texts, tokenizer),
+            texts, tokens, repeat, expected)
+    # A warm vocabulary, and a cold one per run.
+    page_counts(texts, tokenizer)
+    measure("tokenizer, page at a time", lambda: page_counts(texts, tokenizer),
+            texts, tokens, repeat, expected)
+    measure("tokenizer, cold vocabulary",
+            lambda: page_counts(texts, Tokenizer(stop_words)), texts, tokens,
+            repeat, expected)
+    measure(f"tokenizer, batches of {batch_size}",
+            lambda: batch_counts(texts, tokenizer, batch_size), texts, tokens,
+            repeat, expected)
+    total = Counter()
+    for counts in expected:
+        total.update(counts)
+    start = time.perf_counter()
+    assert tokenizer.total(
+        tokenizer.encode_batch(texts)) == total, "total counted wrong"
+    print(f"{'tokenizer, total':<28} "
+          f"{len(texts) / (time.perf_counter() - start):10.1f} pages/sec")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("corpus")
+    parser.add_argument("--pages", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--batch_size", type=int, default=256)
+    args = parser.parse_args()
+    main(args.corpus, args.pages, args.repeat, args.batch_size)
@@ -0,0 +1,93 @@
+''' Validations per second of scraper.is_valid.
+
+    python -m bench.url_policy Logs/Worker.log unique_pages.txt --count 1000000
+
+Reads urls from crawl logs ("Downloaded <url>, status ...") or plain url
+lists, cycles them up to --count, and times the old uncompiled is_valid,
+the compiled policy without its cache, and the cached policy.
+'''
+import re
+import time
+
+from argparse import ArgumentParser
+from itertools import cycle, islice
+from urllib.parse import urlparse
+
+import scraper
+
+LOG_LINE = re.compile(r"Downloaded (\S+), status")
+
+
+def legacy_is_valid(url):
+    # is_valid as it was before the rules were compiled into a UrlPolicy.
+    parsed = urlparse(url)
+    if parsed.scheme not in set(["http", "https"]):
+        return False
+    netloc = parsed.netloc
+    allowed_domains = [".ics.uci.edu", ".cs.uci.edu", ".informatics.uci.edu", ".stat.uci.edu"]
+    if not any(domain in netloc for domain in allowed_domains):
+        return False
+    if "action=download" in parsed.query:
+        return False
+    if "action=upload" in parsed.query:
+        return False
+    if "ical=1" in parsed.query:
+        return False
+    if "/wp-content/uploads" in parsed.path:
+        return False
+    if "pdf" in parsed.path:
+        return False
+    return not re.match(
+        r".*\.(css|js|bmp|gif|jpe?g|ico"
+        + r"|png|tiff?|mid|mp2|mp3|mp4"
+        + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
+        + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
+        + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
+        + r"|epub|dll|cnf|tgz|sha1"
+        + r"|thmx|mso|arff|rtf|jar|csv"
+        + r"|txt|ppsx|war|r|bib|mat|m|uai|java|py|scm|rkt|ss|sql|odc|img"
+        + r"|rm|smil|wmv|swf|wma|zip|rar|gz)$", parsed.path.lower())
+
+
+def read_urls(paths):
+    urls = list()
+    for path in paths:
+        with open(path, errors="replace") as file:
+            for line in file:
+                match = LOG_LINE.search(line)
+                if match:
+                    urls.append(match.group(1))
+                elif line.startswith("http"):
+                    urls.append(line.strip())
+    return urls
+
+
+def measure(name, is_valid, urls):
+    start = time.perf_counter()
+    for url in urls:
+        is_valid(url)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {len(urls) / elapsed:12.0f} validations/sec")
+
+
+def main(paths, count):
+    urls = read_urls(paths)
+    print(f"{len(urls)} urls read, {len(set(urls))} distinct, "
+          f"cycled to {count}.")
+    urls = list(islice(cycle(urls), count))
+    disagree = sum(
+        legacy_is_valid(url) != scraper.url_policy._evaluate(url)
+        for url in set(urls))
+    print(f"{disagree} distinct urls get a different verdict.")
+    measure("legacy is_valid", legacy_is_valid, urls)
+    measure("compiled, uncached", scraper.url_policy._evaluate, urls)
+    measure("compiled, cached", scraper.is_valid, urls)
+    print(scraper.url_policy.cache_info())
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--count", type=int, default=1000000)
+    args = parser.parse_args()
+    main(args.paths, args.count)
@@ -1,16 +1,31 @@
-from utils import get_logger
+from utils import get_logger, canonical
+from utils.metrics import MetricsService
 from crawler.frontier import Frontier
 from crawler.worker import Worker
+import scraper
 
 class Crawler(object):
     def __init__(self, config, restart, frontier_factory=Frontier, worker_factory=Worker):
         self.config = config
         self.logger = get_logger("CRAWLER")
+        canonical.configure(
+            config.drop_params, config.sort_query, config.index_pages)
         self.frontier = frontier_factory(config, restart)
         self.workers = list()
         self.worker_factory = worker_factory
+        self.metrics = MetricsService(
+            self.logger, config.stats_interval, config.metrics_file,
+            config.metrics_port, config.profile)
+        scraper.state.analytics.set_schedule(
+            config.snapshot_pages, config.snapshot_interval)
+        scraper.state.max_page_bytes = config.max_page_bytes
+        scraper.state.set_near_duplicates(
+            config.near_duplicate_distance, config.near_duplicate_fingerprints)
+        scraper.state.set_token_log(
+            config.token_log, config.token_log_compression)
 
     def start_async(self):
+        self.metrics.start()
         self.workers = [
             self.worker_factory(worker_id, self.config, self.frontier)
             for worker_id in range(self.config.threads_count)]
@@ -22,5 +37,10 @@ class Crawler(object):
         self.join()
 
     def join(self):
-        for worker in self.workers:
-            worker.join()
+        try:
+            for worker in self.workers:
+                worker.join()
+        finally:
+            self.metrics.stop()
+            self.frontier.close()
+            scraper.state.close()
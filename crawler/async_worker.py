@@ -0,0 +1,50 @@
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+
+from utils.async_download import AsyncDownloader
+from utils import get_logger
+from crawler.worker import CrawlTask, check_scraper
+
+
+class AsyncWorker(Thread):
+    ''' Drop-in replacement for Worker that keeps
+    config.download_concurrency downloads in flight from one thread. The
+    frontier still decides which url is due, so politeness per host is
+    unchanged; scraping runs on the event loop thread, one page at a time. '''
+    def __init__(self, worker_id, config, frontier):
+        self.logger = get_logger(f"AsyncWorker-{worker_id}", "Worker")
+        self.config = config
+        self.frontier = frontier
+        check_scraper()
+        super().__init__(daemon=True)
+
+    def run(self):
+        asyncio.run(self._crawl())
+
+    async def _crawl(self):
+        # get_tbd_url blocks until a host is due, so each task waits for
+        # it on a thread of its own instead of on the event loop.
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.config.download_concurrency)
+        async with AsyncDownloader(self.config, self.logger) as downloader:
+            await asyncio.gather(*(
+                self._crawl_task(downloader)
+                for _ in range(self.config.download_concurrency)))
+        self.executor.shutdown()
+        self.logger.info("Frontier is empty. Stopping Crawler.")
+
+    async def _crawl_task(self, downloader):
+        loop = asyncio.get_running_loop()
+        while True:
+            tbd_url = await loop.run_in_executor(
+                self.executor, self.frontier.get_tbd_url)
+            if not tbd_url:
+                break
+            with CrawlTask(self.frontier, tbd_url, self.logger) as task:
+                resp = await downloader.download(tbd_url)
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server}.")
+                task.scrape(resp)
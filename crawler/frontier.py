@@ -1,17 +1,76 @@
 import os
-import shelve
+import json
+import time
+import heapq
 
-from threading import Thread, RLock
+from collections import deque
+from hashlib import blake2b
+from threading import Thread, RLock, Condition
 from queue import Queue, Empty
+from urllib.parse import urlparse, urlsplit
 
-from utils import get_logger, get_urlhash, normalize
+from utils import get_logger, get_urlhash, get_urldigest, normalize, metrics
+from utils.bloom import BloomFilter
+from crawler.store import get_store, remove_store
+from crawler.traps import TrapDetector
+from crawler.hosts import HostController
+import scraper
 from scraper import is_valid
 
 class Frontier(object):
     def __init__(self, config, restart):
         self.logger = get_logger("FRONTIER")
         self.config = config
-        self.to_be_downloaded = list()
+        # Urls waiting to be downloaded, one queue per host.
+        self.host_queues = dict()
+        # (ready time, host) for every host that has urls queued and is not
+        # currently being downloaded from.
+        self.ready_hosts = list()
+        # Hosts checked out by a worker, and when each host was last hit.
+        self.busy_hosts = set()
+        self.last_access = dict()
+        self.in_flight = 0
+        # Urls in host_queues, and the pages of pending urls in the save
+        # file that are not queued yet (None once all were read).
+        self.queued = 0
+        self.pending_pages = None
+        # How often to re-check for work while waiting on urls in flight;
+        # None waits for this frontier's own workers to report back.
+        self.poll_interval = None
+        # Origins ("scheme://host") that redirect every path to the same path
+        # on another origin, e.g. http -> https or ics.uci.edu ->
+        # www.ics.uci.edu: origin -> [target origin, redirects seen]. A rule
+        # seen REDIRECTRULEMIN times rewrites new urls before they are queued,
+        # saving the download that would only redirect.
+        self.origin_redirects = dict()
+        self.redirects_rewritten = 0
+        self.traps = TrapDetector(
+            config.trap_template_budget, config.trap_host_budget,
+            config.trap_query_budget)
+        # How long each host waits between two downloads, and which hosts
+        # are blacklisted for failing.
+        self.hosts = HostController(
+            config.time_delay, config.max_time_delay, config.latency_factor,
+            config.blacklist_after, config.blacklist_seconds)
+        self.completed_count = 0
+        # Downloaded pages whose content had not changed since the last
+        # download, so they were not parsed again.
+        self.unchanged_count = 0
+        # url -> digest of the page downloaded for each url in flight, saved
+        # only once the url is completed: a url handed back keeps the
+        # digest of its last completed download, so it is parsed again.
+        self.digests = dict()
+        # Digests of every url in the save file. A url the filter has not
+        # seen is new without asking the save file; only the filter's
+        # "maybe" answers are checked there.
+        self.seen = BloomFilter(
+            config.seen_filter_capacity, config.seen_filter_error_rate)
+        self.seen_file = f"{config.save_file}.bloom"
+        self.seen_loaded = False
+        self.seen_lookups = 0
+        self.store_lookups = 0
+        self.lock = RLock()
+        self.state_changed = Condition(self.lock)
         
         if not os.path.exists(self.config.save_file) and not restart:
             # Save file does not exist, but request to load save.
@@ -22,9 +81,32 @@ class Frontier(object):
             # Save file does exists, but request to start from seed.
             self.logger.info(
                 f"Found save file {self.config.save_file}, deleting it.")
-            os.remove(self.config.save_file)
+            remove_store(self.config.save_file)
         # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.save_file)
+        self.save = get_store(self.config)
+        traps = self.save.get_meta("traps")
+        if traps:
+            self.traps.loads(traps)
+        hosts = self.save.get_meta("hosts")
+        if hosts:
+            self.hosts.loads(hosts)
+        origin_redirects = self.save.get_meta("redirects")
+        if origin_redirects:
+            self.origin_redirects = json.loads(origin_redirects)
+        # The report counters of the earlier runs. Pages a re-crawl finds
+        # unchanged are not parsed, so their counts must come from here.
+        analytics = self.save.get_meta("analytics")
+        if analytics:
+            scraper.state.analytics.loads(analytics)
+        if not restart:
+            # The filter saved on close holds every url of the save file if
+            # nothing was added to it since.
+            self.seen_loaded = self.seen.load(self.seen_file, len(self.save))
+        self._register_metrics()
+        # The scraper reports near-duplicate pages back to the trap detector,
+        # and redirected pages to the redirect map.
+        scraper.state.near_duplicate_listeners.append(self._record_duplicate)
+        scraper.state.redirect_listeners.append(self.add_redirect)
         if restart:
             for url in self.config.seed_urls:
                 self.add_url(url)
@@ -35,38 +117,325 @@ class Frontier(object):
                 for url in self.config.seed_urls:
                     self.add_url(url)
 
+    def _register_metrics(self):
+        def locked(function):
+            def read():
+                with self.lock:
+                    return function()
+            return read
+        self.metric_callbacks = [
+            ("frontier_queued_urls", "Urls queued in memory.",
+             lambda: self.queued, "gauge", None),
+            ("frontier_pending_urls", "Urls not downloaded yet, in memory "
+             "or in the save file.", self.save.pending_count, "gauge", None),
+            ("frontier_host_queue_depth", "Urls queued per host.",
+             lambda: {host: len(queue)
+                      for host, queue in self.host_queues.items()},
+             "gauge", "host"),
+            ("frontier_in_flight_urls", "Urls handed to a worker and not "
+             "completed yet.", lambda: self.in_flight, "gauge", None),
+            ("frontier_host_delay_seconds", "Seconds between two downloads "
+             "from each host with urls queued.",
+             lambda: {host: self.hosts.delay(host)
+                      for host in self.host_queues}, "gauge", "host"),
+            ("frontier_blacklisted_hosts", "Hosts blacklisted for failing.",
+             lambda: len(self.hosts.blacklisted()), "gauge", None),
+            ("frontier_trap_rejections_total", "Urls rejected by the trap "
+             "detector, by reason.", lambda: dict(self.traps.rejected),
+             "counter", "reason"),
+            ("frontier_unchanged_pages_total", "Pages downloaded again "
+             "with unchanged content, and not parsed.",
+             lambda: self.unchanged_count, "counter", None),
+            ("frontier_redirect_rules", "Origins whose urls are rewritten "
+             "to the origin they redirect to.",
+             lambda: sum(1 for _, seen in self.origin_redirects.values()
+                         if seen >= self.config.redirect_rule_min),
+             "gauge", None),
+            ("frontier_redirect_rewrites_total", "Added urls rewritten to "
+             "the origin they redirect to.", lambda: self.redirects_rewritten,
+             "counter", None),
+            ("frontier_seen_lookups_total", "Urls checked against the seen "
+             "filter.", lambda: self.seen_lookups, "counter", None),
+            ("frontier_store_lookups_total", "Urls the seen filter could not "
+             "rule out, checked in the save file.",
+             lambda: self.store_lookups, "counter", None)]
+        for name, help, function, kind, label in self.metric_callbacks:
+            metrics.callback(name, help, locked(function), kind, label)
+
     def _parse_save_file(self):
         ''' This function can be overridden for alternate saving techniques. '''
+        if self.config.recrawl:
+            # A page is due when its revisit falls before the middle of the
+            # shortest interval from now, so that a nightly re-crawl also
+            # takes the pages downloaded later in the night before.
+            due = self.save.mark_due(
+                time.time() + self.config.recrawl_min_interval / 2)
+            self.logger.info(f"Re-crawling {due} downloaded urls that are due.")
         total_count = len(self.save)
-        tbd_count = 0
-        for url, completed in self.save.values():
-            if not completed and is_valid(url):
-                self.to_be_downloaded.append(url)
-                tbd_count += 1
+        tbd_count = self.save.pending_count()
+        with self.lock:
+            if not self.seen_loaded:
+                # The seen filter was not saved on a clean shutdown, so it
+                # is rebuilt from every url.
+                for url, completed in self.save.values():
+                    self.seen.add(get_urldigest(get_urlhash(url)))
+            # The pending urls are queued a page at a time, as the queues
+            # run low.
+            self.pending_pages = self.save.pending_pages(
+                self.config.pending_page_size)
+            self._load_pending()
         self.logger.info(
             f"Found {tbd_count} urls to be downloaded from {total_count} "
             f"total urls discovered.")
 
+    def _load_pending(self):
+        ''' Queues the next page of pending urls from the save file. Returns
+        how many of them were dropped by is_valid. '''
+        page = next(self.pending_pages, None)
+        if page is None:
+            self.pending_pages = None
+            return 0
+        dropped = 0
+        for url in page:
+            if is_valid(url):
+                self._enqueue(url)
+            else:
+                dropped += 1
+        return dropped
+
+    def _enqueue(self, url):
+        host = urlparse(url).hostname
+        queue = self.host_queues.get(host)
+        if queue is None:
+            queue = self.host_queues[host] = deque()
+        queue.append(url)
+        self.queued += 1
+        if len(queue) == 1 and host not in self.busy_hosts:
+            self._schedule(host)
+
+    def _schedule(self, host):
+        # A host becomes ready its own delay after it was last hit, or when
+        # its blacklist expires; its urls stay queued until then.
+        ready_time = self.last_access.get(host, 0) + self.hosts.delay(host)
+        blacklisted_until = self.hosts.blacklisted_until(host)
+        if blacklisted_until:
+            ready_time = max(ready_time, time.monotonic()
+                             + blacklisted_until - time.time())
+        heapq.heappush(self.ready_hosts, (ready_time, host))
+        self.state_changed.notify()
+
     def get_tbd_url(self):
-        try:
-            return self.to_be_downloaded.pop()
-        except IndexError:
-            return None
+        ''' Blocks until some host is due, and returns one of its urls.
+        Returns None once there is nothing queued and nothing in flight. '''
+        with self.lock:
+            while True:
+                if (self.pending_pages is not None
+                        and self.queued < self.config.pending_page_size // 2):
+                    self._load_pending()
+                    continue
+                if self.ready_hosts:
+                    ready_time, host = self.ready_hosts[0]
+                    wait = ready_time - time.monotonic()
+                    if wait <= 0:
+                        heapq.heappop(self.ready_hosts)
+                        url = self.host_queues[host].pop()
+                        self.queued -= 1
+                        self.busy_hosts.add(host)
+                        self.in_flight += 1
+                        return url
+                    self.state_changed.wait(wait)
+                elif self._expecting_urls():
+                    # Urls being downloaded right now can still add more.
+                    self.state_changed.wait(self.poll_interval)
+                else:
+                    self.state_changed.notify_all()
+                    return None
+
+    def _expecting_urls(self):
+        return self.in_flight > 0
 
     def add_url(self, url):
-        url = normalize(url)
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            self.save[urlhash] = (url, False)
-            self.save.sync()
-            self.to_be_downloaded.append(url)
+        ''' Returns True if url was new and is now queued. '''
+        canonical_url = normalize(url)
+        with self.lock:
+            canonical_url = self._rewrite(canonical_url)
+            urlhash = get_urlhash(canonical_url)
+            digest = get_urldigest(urlhash)
+            self.seen_lookups += 1
+            if digest not in self.seen or not self._stored(urlhash):
+                if not self.traps.admit(canonical_url):
+                    return False
+                self.seen.add(digest)
+                self.save.put(urlhash, canonical_url, False)
+                self._enqueue(canonical_url)
+                return True
+            return False
     
+    def _rewrite(self, url):
+        # Moves url to the origin its own origin is known to redirect to.
+        if not self.origin_redirects:
+            return url
+        origin, _, rest = url.partition("://")
+        host, slash, rest = rest.partition("/")
+        rule = self.origin_redirects.get(f"{origin}://{host}")
+        if rule is None or rule[1] < self.config.redirect_rule_min:
+            return url
+        self.redirects_rewritten += 1
+        return f"{rule[0]}{slash}{rest}"
+
+    def add_redirect(self, url, target):
+        ''' Records that downloading url gave the page at target. A target
+        the frontier has not seen counts as downloaded. A redirect that only
+        changes the origin (scheme and host) counts towards rewriting the
+        other urls of that origin too. '''
+        url = normalize(url)
+        target = normalize(target)
+        urlhash = get_urlhash(target)
+        source_parts = urlsplit(url)
+        target_parts = urlsplit(target)
+        with self.lock:
+            if (source_parts[2:] == target_parts[2:]
+                    and source_parts[:2] != target_parts[:2]):
+                origin = f"{source_parts.scheme}://{source_parts.netloc}"
+                target_origin = (
+                    f"{target_parts.scheme}://{target_parts.netloc}")
+                rule = self.origin_redirects.get(origin)
+                if rule is not None and rule[0] == target_origin:
+                    rule[1] += 1
+                else:
+                    # A different target starts the count over.
+                    self.origin_redirects[origin] = [target_origin, 1]
+            # A target that is already saved is left as it is: a pending one
+            # may be counted as outstanding, or not be paged in yet, and is
+            # downloaded again like any other pending url.
+            if self.save.get(urlhash) is None:
+                self.seen.add(get_urldigest(urlhash))
+                self.save.put(urlhash, target, True)
+
+    def _stored(self, urlhash):
+        self.store_lookups += 1
+        return urlhash in self.save
+
+    def record_response(self, url, resp):
+        ''' Tells the host controller how the host of url answered, and
+        keeps the digest of the page for mark_url_complete to save. Call it
+        before mark_url_complete, which schedules the host's next url.
+        Returns False when the page is the same as when it was last
+        downloaded, and need not be parsed. '''
+        host = urlparse(url).hostname
+        elapsed = getattr(resp.raw_response, "elapsed", None)
+        latency = elapsed.total_seconds() if elapsed else None
+        content = getattr(resp.raw_response, "content", None)
+        digest = (blake2b(content, digest_size=16).hexdigest()
+                  if resp.status == 200 and content else None)
+        with self.lock:
+            if self.hosts.record(host, resp.status, latency):
+                queue = self.host_queues.get(host)
+                self.logger.warning(
+                    f"Blacklisted {host} for {self.hosts.blacklist_seconds} "
+                    f"seconds after {self.hosts.blacklist_after} failures, "
+                    f"{len(queue) if queue else 0} queued urls wait until "
+                    f"then.")
+            if digest is None:
+                return True
+            self.digests[url] = digest
+            previous = self.save.get_fetch(get_urlhash(url))
+            if previous is not None and previous[0] == digest:
+                self.unchanged_count += 1
+                return False
+            return True
+
+    def _record_fetch(self, urlhash, digest):
+        # The revisit interval halves when the page changed and doubles
+        # when it did not, between RECRAWLMIN and RECRAWLMAX.
+        previous = self.save.get_fetch(urlhash)
+        if previous is None:
+            revisit = self.config.recrawl_min_interval
+            changes = 0
+        else:
+            last_digest, _, revisit, changes = previous
+            if digest != last_digest:
+                revisit = max(self.config.recrawl_min_interval, revisit / 2)
+                changes += 1
+            else:
+                revisit = min(self.config.recrawl_max_interval, revisit * 2)
+        self.save.put_fetch(urlhash, digest, time.time(), revisit, changes)
+
     def mark_url_complete(self, url):
         urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            # This should not happen.
-            self.logger.error(
-                f"Completed url {url}, but have not seen it before.")
+        host = urlparse(url).hostname
+        with self.lock:
+            if get_urldigest(urlhash) not in self.seen:
+                # This should not happen.
+                self.logger.error(
+                    f"Completed url {url}, but have not seen it before.")
+
+            self.save.put(urlhash, url, True)
+            # After the url and the links found on it, so that no commit
+            # has the digest without them.
+            digest = self.digests.pop(url, None)
+            if digest is not None:
+                self._record_fetch(urlhash, digest)
+            self.traps.record_fetch(url)
+            self.completed_count += 1
+            if self.completed_count % 1000 == 0:
+                self.save.put_meta("traps", self.traps.dumps())
+                self.save.put_meta("hosts", self.hosts.dumps())
+                self.save.put_meta(
+                    "redirects", json.dumps(self.origin_redirects))
+                self.save.put_meta(
+                    "analytics", scraper.state.analytics.dumps())
+
+            self._release_host(host)
+            self.state_changed.notify_all()
+
+    def release_url(self, url):
+        ''' Hands url back without completing it, e.g. when the worker
+        failed on it: its host is free for the other workers again, and url
+        stays pending in the save file for the next run. '''
+        host = urlparse(url).hostname
+        with self.lock:
+            self.digests.pop(url, None)
+            self._release_host(host)
+            self.state_changed.notify_all()
+
+    def _release_host(self, host):
+        self.last_access[host] = time.monotonic()
+        if host in self.busy_hosts:
+            self.busy_hosts.discard(host)
+            self.in_flight -= 1
+            if self.host_queues.get(host):
+                self._schedule(host)
+            else:
+                self.host_queues.pop(host, None)
 
-        self.save[urlhash] = (url, True)
-        self.save.sync()
+    def _record_duplicate(self, url):
+        with self.lock:
+            self.traps.record_duplicate(url)
+
+    def close(self):
+        # Commit whatever the save file has not grouped into a commit yet.
+        with self.lock:
+            scraper.state.near_duplicate_listeners.remove(self._record_duplicate)
+            scraper.state.redirect_listeners.remove(self.add_redirect)
+            for name, *_ in self.metric_callbacks:
+                metrics.remove(name)
+            self.save.put_meta("traps", self.traps.dumps())
+            self.save.put_meta("hosts", self.hosts.dumps())
+            self.save.put_meta("redirects", json.dumps(self.origin_redirects))
+            self.save.put_meta("analytics", scraper.state.analytics.dumps())
+            self.save.flush()
+            self.seen.save(self.seen_file, len(self.save))
+            self.save.close()
+        self.logger.info(
+            f"Rewrote {self.redirects_rewritten} urls to the origin they "
+            f"redirect to.")
+        self.logger.info(
+            f"Skipped parsing {self.unchanged_count} unchanged pages.")
+        self.logger.info(f"Trap detector rejected {self.traps.rejected}.")
+        self.logger.info(
+            f"Blacklisted hosts {self.hosts.blacklistings} times, "
+            f"{len(self.hosts.blacklisted())} still blacklisted.")
+        self.logger.info(
+            f"Seen filter answered {self.seen_lookups - self.store_lookups} "
+            f"of {self.seen_lookups} lookups without the save file.")
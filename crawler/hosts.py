@@ -0,0 +1,105 @@
+import json
+import time
+
+from crawler.traps import BoundedCounts
+
+# The cache server's status for a page it could not download: a timeout, a
+# refused connection or an unknown host.
+DOWNLOAD_ERROR = 601
+
+
+def is_failure(status):
+    ''' True for responses that say the host is struggling: a 5xx, or a
+    download error the cache server ran into. 600 means the cache server
+    itself could not be reached, which says nothing about the host. '''
+    return 500 <= status < 600 or status == DOWNLOAD_ERROR
+
+
+class HostController(object):
+    ''' Decides how long to wait between two downloads from each host, from
+    how the host has been answering:
+    - a moving average of its response time, of which the delay is
+      latency_factor times, but never less than floor (POLITENESS), so
+      fast healthy hosts are crawled at the floor;
+    - a moving average of its failure rate and its consecutive failures,
+      which multiply the delay (doubling per failure) up to ceiling;
+    - blacklist_after failures in a row blacklist the host for
+      blacklist_seconds. When it expires one more url is tried, and one
+      more failure blacklists it again.
+    State is kept for the max_hosts most recently seen hosts and saved with
+    the frontier, so a restart does not go back to hosts it found dead. '''
+    def __init__(self, floor=0.5, ceiling=60, latency_factor=2,
+                 blacklist_after=5, blacklist_seconds=600, alpha=0.2,
+                 max_hosts=100000):
+        self.floor = floor
+        self.ceiling = max(ceiling, floor)
+        self.latency_factor = latency_factor
+        self.blacklist_after = blacklist_after
+        self.blacklist_seconds = blacklist_seconds
+        self.alpha = alpha
+        self.max_hosts = max_hosts
+        # host -> [latency, failure rate, failures in a row, blacklisted
+        # until (time.time(), so that it survives a restart)]
+        self.hosts = BoundedCounts(max_hosts)
+        self.blacklistings = 0
+
+    def record(self, host, status, latency=None, now=None):
+        ''' Updates host with one response, and latency, its response time
+        in seconds when known. Returns True if this response got the host
+        blacklisted. '''
+        stats = self.hosts.touch(host, [0.0, 0.0, 0, 0.0])
+        if latency is not None:
+            stats[0] = (latency if not stats[0]
+                        else stats[0] + self.alpha * (latency - stats[0]))
+        failed = is_failure(status)
+        stats[1] += self.alpha * (failed - stats[1])
+        if not failed:
+            stats[2] = 0
+            return False
+        stats[2] += 1
+        now = time.time() if now is None else now
+        if stats[2] >= self.blacklist_after and stats[3] <= now:
+            stats[3] = now + self.blacklist_seconds
+            self.blacklistings += 1
+            return True
+        return False
+
+    def delay(self, host):
+        ''' Seconds to wait after a download from host before the next. '''
+        stats = self.hosts.get(host)
+        if stats is None:
+            return self.floor
+        latency, failure_rate, failures, _ = stats
+        backoff = max(2 ** min(failures, 16), 1 + 4 * failure_rate)
+        return max(self.floor, min(
+            self.ceiling,
+            max(self.floor, self.latency_factor * latency) * backoff))
+
+    def is_blacklisted(self, host, now=None):
+        stats = self.hosts.get(host)
+        if stats is None or not stats[3]:
+            return False
+        return stats[3] > (time.time() if now is None else now)
+
+    def blacklisted_until(self, host, now=None):
+        ''' When (time.time()) the blacklist of host expires, or 0 if it is
+        not blacklisted. '''
+        if not self.is_blacklisted(host, now):
+            return 0
+        return self.hosts.get(host)[3]
+
+    def blacklisted(self, now=None):
+        ''' The hosts blacklisted right now, with when they are let back. '''
+        now = time.time() if now is None else now
+        return {host: stats[3] for host, stats in self.hosts.items()
+                if stats[3] > now}
+
+    def dumps(self):
+        return json.dumps({
+            "hosts": list(self.hosts.items()),
+            "blacklistings": self.blacklistings})
+
+    def loads(self, data):
+        state = json.loads(data)
+        self.hosts = BoundedCounts(self.max_hosts, state["hosts"])
+        self.blacklistings = state["blacklistings"]
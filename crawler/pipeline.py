@@ -0,0 +1,211 @@
+import time
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from queue import Queue
+from threading import Thread, Lock, BoundedSemaphore, Event
+
+from utils import get_logger, canonical, metrics
+from utils.download import download
+from crawler.frontier import Frontier
+from crawler.worker import CrawlTask
+import scraper
+
+
+def _init_parser(config):
+    # Parser processes start fresh, so they need the configured rules too.
+    canonical.configure(
+        config.drop_params, config.sort_query, config.index_pages)
+    scraper.state.max_page_bytes = config.max_page_bytes
+
+
+class StageStats(object):
+    ''' Items and seconds spent in one pipeline stage. '''
+    def __init__(self):
+        self.lock = Lock()
+        self.count = 0
+        self.seconds = 0.0
+
+    def add(self, seconds):
+        with self.lock:
+            self.count += 1
+            self.seconds += seconds
+
+    def describe(self, elapsed):
+        average = self.seconds / self.count if self.count else 0
+        rate = self.count / elapsed if elapsed else 0
+        return (f"{self.count} done, {rate:.1f}/s, "
+                f"{average * 1000:.1f} ms avg")
+
+
+class PipelineCrawler(object):
+    ''' Crawler that overlaps downloading and parsing:
+
+        fetcher threads -> fetched queue -> parser processes -> aggregator
+
+    THREADCOUNT fetcher threads download urls from the frontier onto a
+    bounded queue. A dispatcher hands them to a ProcessPoolExecutor running
+    scraper.parse_page, with at most twice PARSERS pages being parsed or
+    waiting to be recorded. A single aggregator thread applies every result
+    with scraper.record_page and updates the frontier, so the crawl state is
+    only ever touched from one thread. Full queues block the stage before
+    them. If a parser process dies, the pool is broken for good: the crawl
+    stops, and the urls in the pipeline stay pending for the next run. '''
+    def __init__(self, config, restart, frontier_factory=Frontier):
+        self.config = config
+        self.logger = get_logger("PIPELINE")
+        canonical.configure(
+            config.drop_params, config.sort_query, config.index_pages)
+        scraper.state.analytics.set_schedule(
+            config.snapshot_pages, config.snapshot_interval)
+        scraper.state.max_page_bytes = config.max_page_bytes
+        scraper.state.set_near_duplicates(
+            config.near_duplicate_distance, config.near_duplicate_fingerprints)
+        scraper.state.set_token_log(
+            config.token_log, config.token_log_compression)
+        self.frontier = frontier_factory(config, restart)
+        self.fetched = Queue(maxsize=config.pipeline_queue_size)
+        self.parsed = Queue()
+        self.parse_slots = BoundedSemaphore(2 * config.parsers)
+        # Set when the parser pool broke; the fetchers stop taking urls.
+        self.stopping = Event()
+        self.stages = {
+            "fetch": StageStats(), "parse": StageStats(),
+            "record": StageStats()}
+        self.started = self.last_report = time.monotonic()
+        metrics.callback(
+            "pipeline_fetched_queue", "Downloaded pages waiting for a parser.",
+            self.fetched.qsize)
+        metrics.callback(
+            "pipeline_parsed_queue", "Parsed pages waiting to be recorded.",
+            self.parsed.qsize)
+        self.metrics = metrics.MetricsService(
+            self.logger, config.stats_interval, config.metrics_file,
+            config.metrics_port, config.profile)
+
+    def start(self):
+        self.metrics.start()
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.config.parsers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_parser, initargs=(self.config,))
+        fetchers = [
+            Thread(target=self._fetch, daemon=True)
+            for _ in range(self.config.threads_count)]
+        dispatcher = Thread(
+            target=self._dispatch, args=(len(fetchers),), daemon=True)
+        for thread in fetchers + [dispatcher]:
+            thread.start()
+        try:
+            self._aggregate()
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+            self.metrics.stop()
+            self.frontier.close()
+            scraper.state.close()
+            self._report()
+
+    def _stop(self, reason):
+        if not self.stopping.is_set():
+            self.logger.error(f"Stopping the crawl: {reason}")
+            self.stopping.set()
+
+    def _fetch(self):
+        try:
+            while not self.stopping.is_set():
+                url = self.frontier.get_tbd_url()
+                if not url:
+                    break
+                if self.stopping.is_set():
+                    self.frontier.release_url(url)
+                    break
+                self._fetch_url(url)
+        finally:
+            # The dispatcher waits for a None from every fetcher.
+            self.fetched.put(None)
+
+    def _fetch_url(self, url):
+        with CrawlTask(self.frontier, url, self.logger) as task:
+            start = time.perf_counter()
+            resp = download(url, self.config, self.logger)
+            self.stages["fetch"].add(time.perf_counter() - start)
+            if task.changed(resp):
+                # Blocks while the parsers are behind. The aggregator
+                # completes the url once the page is parsed.
+                self.fetched.put((url, resp))
+                task.hand_on()
+
+    def _dispatch(self, fetchers):
+        try:
+            while fetchers:
+                item = self.fetched.get()
+                if item is None:
+                    fetchers -= 1
+                    continue
+                url, resp = item
+                if self.stopping.is_set():
+                    # Nothing parses it any more; the fetched queue is
+                    # still drained so that no fetcher blocks on it.
+                    self.frontier.release_url(url)
+                    continue
+                self._submit(url, resp)
+            # Every fetcher is done, so every page has been submitted; wait
+            # for the parsers to finish them before telling the aggregator.
+            self.executor.shutdown(wait=True)
+        finally:
+            # The aggregator runs until it gets this None.
+            self.parsed.put(None)
+
+    def _submit(self, url, resp):
+        self.parse_slots.acquire()
+        submitted = time.perf_counter()
+        try:
+            future = self.executor.submit(scraper.parse_page, url, resp)
+        except Exception as e:
+            self.parse_slots.release()
+            self.frontier.release_url(url)
+            self.logger.error(f"Failed to hand {url} to a parser: {e}")
+            if isinstance(e, BrokenProcessPool):
+                self._stop("a parser process died.")
+            return
+        future.add_done_callback(
+            lambda future, url=url, submitted=submitted: self.parsed.put(
+                (url, future, submitted)))
+
+    def _aggregate(self):
+        while True:
+            item = self.parsed.get()
+            if item is None:
+                break
+            url, future, submitted = item
+            self.stages["parse"].add(time.perf_counter() - submitted)
+            start = time.perf_counter()
+            try:
+                # A page whose parse raised is released, so it is parsed
+                # again next run.
+                with CrawlTask(self.frontier, url, self.logger) as task:
+                    if isinstance(future.exception(), BrokenProcessPool):
+                        self._stop("a parser process died.")
+                    links = scraper.record_page(url, future.result())
+                    task.add_links(
+                        link for link in links if scraper.is_valid(link))
+            finally:
+                self.parse_slots.release()
+            self.stages["record"].add(time.perf_counter() - start)
+            if time.monotonic() - self.last_report >= self.config.stats_interval:
+                self._report()
+
+    def stats(self):
+        ''' Queue depths and per-stage counts and latencies. '''
+        elapsed = time.monotonic() - self.started
+        return {
+            "fetched queue": self.fetched.qsize(),
+            "parsed queue": self.parsed.qsize(),
+            **{name: stage.describe(elapsed)
+               for name, stage in self.stages.items()}}
+
+    def _report(self):
+        self.last_report = time.monotonic()
+        self.logger.info(" | ".join(
+            f"{name}: {value}" for name, value in self.stats().items()))
@@ -0,0 +1,224 @@
+import os
+import multiprocessing
+
+from functools import partial
+from queue import Empty
+from threading import Thread, BrokenBarrierError
+from urllib.parse import urlparse
+from zlib import crc32
+
+from utils import get_logger, normalize
+from utils.analytics import Analytics, UniquePages
+from crawler import Crawler
+from crawler.frontier import Frontier
+from crawler.worker import Worker
+import scraper
+
+
+def shard_of(url, shards):
+    ''' The shard that owns url. Whole hosts map to one shard, so each
+    process keeps politeness for its hosts on its own. '''
+    host = urlparse(url).hostname or ""
+    return crc32(host.encode("utf-8")) % shards
+
+
+def shard_save_file(save_file, shard_id):
+    root, ext = os.path.splitext(save_file)
+    return f"{root}.shard{shard_id}{ext}"
+
+
+class ShardFrontier(Frontier):
+    ''' Frontier for the hosts that hash to shard_id. Urls for other hosts
+    are sent to their owner's inbox queue.
+
+    outstanding is shared by all shards and counts every url that is queued
+    or in flight in some shard, plus every url on its way to an inbox. The
+    crawl is over once it drops to zero, or once stop is set: then a shard
+    died, and its urls will never be counted off. '''
+    def __init__(self, config, restart, shard_id=0, shards=1, inboxes=None,
+                 outstanding=None, stop=None):
+        self.shard_id = shard_id
+        self.shards = shards
+        self.inboxes = inboxes
+        self.outstanding = outstanding
+        self.stop = stop
+        super().__init__(config, restart)
+        # Other shards do not notify this frontier's condition, so workers
+        # waiting for urls re-check the shared count now and then.
+        self.poll_interval = 0.5
+        self.inbox_thread = Thread(target=self._read_inbox, daemon=True)
+        self.inbox_thread.start()
+
+    def _count(self, delta):
+        with self.outstanding.get_lock():
+            self.outstanding.value += delta
+
+    def _parse_save_file(self):
+        super()._parse_save_file()
+        # Pending urls still in the save file count as queued too.
+        self._count(self.save.pending_count())
+
+    def _load_pending(self):
+        dropped = super()._load_pending()
+        self._count(-dropped)
+        return dropped
+
+    def _stopping(self):
+        return self.stop is not None and self.stop.is_set()
+
+    def _expecting_urls(self):
+        if self._stopping():
+            return self.in_flight > 0
+        return self.in_flight > 0 or self.outstanding.value > 0
+
+    def get_tbd_url(self):
+        url = super().get_tbd_url()
+        if url and self._stopping():
+            # Left pending in the save file for the next run.
+            self.release_url(url)
+            return None
+        return url
+
+    def _read_inbox(self):
+        inbox = self.inboxes[self.shard_id]
+        while True:
+            url = inbox.get()
+            if url is None:
+                break
+            # Count the url as queued before it stops counting as sent.
+            if super().add_url(url):
+                self._count(1)
+            self._count(-1)
+            with self.lock:
+                self.state_changed.notify_all()
+
+    def add_url(self, url):
+        # Rewritten first, so that the url goes to the owner of its final
+        # host.
+        with self.lock:
+            url = self._rewrite(normalize(url))
+        owner = shard_of(url, self.shards)
+        if owner != self.shard_id:
+            self._count(1)
+            self.inboxes[owner].put(url)
+            return False
+        if super().add_url(url):
+            self._count(1)
+            return True
+        return False
+
+    def mark_url_complete(self, url):
+        super().mark_url_complete(url)
+        self._count(-1)
+
+    def release_url(self, url):
+        super().release_url(url)
+        self._count(-1)
+
+    def close(self):
+        self.inboxes[self.shard_id].put(None)
+        self.inbox_thread.join()
+        super().close()
+
+
+def run_shard(shard_id, shards, config, restart, worker_factory, inboxes,
+              outstanding, ready, reports, stop):
+    ''' Entry point of one crawler process. '''
+    config.save_file = shard_save_file(config.save_file, shard_id)
+    config.token_log = shard_save_file(config.token_log, shard_id)
+    config.metrics_file = shard_save_file(config.metrics_file, shard_id)
+    if config.metrics_port:
+        config.metrics_port += shard_id
+    scraper.state.analytics.publish = lambda state: reports.put((shard_id, state))
+    crawler = Crawler(config, restart, frontier_factory=partial(
+        ShardFrontier, shard_id=shard_id, shards=shards, inboxes=inboxes,
+        outstanding=outstanding, stop=stop), worker_factory=worker_factory)
+    # Every shard must have counted its seeds and saved urls before any of
+    # them can decide that there is nothing left to crawl.
+    try:
+        ready.wait()
+    except BrokenBarrierError:
+        # Another shard died before the crawl started.
+        crawler.frontier.close()
+        return
+    crawler.start()
+
+
+class ShardedCrawler(object):
+    ''' Runs the crawl in `processes` worker processes, each with its own
+    Crawler, THREADCOUNT workers and frontier shard (save file
+    SAVE.shard<N>). The parent merges the analytics each shard publishes
+    and writes the report files. If a shard process dies, the parent stops
+    the others; the urls left pending are crawled by the next run. '''
+    def __init__(self, config, restart, processes, worker_factory=Worker):
+        self.config = config
+        self.restart = restart
+        self.processes = processes
+        self.worker_factory = worker_factory
+        self.logger = get_logger("CRAWLER")
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        inboxes = [context.Queue() for _ in range(self.processes)]
+        outstanding = context.Value("q", 0)
+        ready = context.Barrier(self.processes)
+        reports = context.Queue()
+        stop = context.Event()
+        workers = [
+            context.Process(target=run_shard, args=(
+                shard_id, self.processes, self.config, self.restart,
+                self.worker_factory, inboxes, outstanding, ready, reports,
+                stop))
+            for shard_id in range(self.processes)]
+        for worker in workers:
+            worker.start()
+
+        states = dict()
+        # Shards only send the unique pages found since their last report.
+        unique_pages = UniquePages()
+        if not self.restart:
+            unique_pages.resume()
+        while any(worker.is_alive() for worker in workers):
+            self._collect(reports, states, unique_pages, timeout=1)
+            if not stop.is_set():
+                self._check_shards(workers, ready, stop)
+        self._collect(reports, states, unique_pages, timeout=0)
+        for worker in workers:
+            worker.join()
+        if stop.is_set():
+            self.logger.error(
+                f"Crawler processes stopped after a shard died; run again "
+                f"without --restart to crawl the urls left pending.")
+        else:
+            self.logger.info(
+                f"All {self.processes} crawler processes finished.")
+
+    def _check_shards(self, workers, ready, stop):
+        # The urls a dead shard had queued are never counted off, so the
+        # others would wait for them forever, or at the barrier.
+        for shard_id, worker in enumerate(workers):
+            if worker.exitcode:
+                self.logger.error(
+                    f"Crawler process {shard_id} exited with code "
+                    f"{worker.exitcode}, stopping the others.")
+                stop.set()
+                ready.abort()
+                return
+
+    def _collect(self, reports, states, unique_pages, timeout):
+        updated = False
+        try:
+            while True:
+                shard_id, state = reports.get(timeout=timeout)
+                unique_pages.update(state["new_pages"])
+                state["new_pages"] = list()
+                states[shard_id] = state
+                updated = True
+                timeout = 0
+        except Empty:
+            pass
+        if updated:
+            merged = Analytics(unique_pages=unique_pages)
+            for state in states.values():
+                merged.merge(state)
+            merged.write_reports()
@@ -0,0 +1,306 @@
+import os
+import glob
+import json
+import shelve
+import sqlite3
+import time
+
+
+def get_store(config):
+    ''' Opens the save file named by config.save_file. A ".shelve" save file
+    keeps the original shelve format, anything else is a SQLite database. '''
+    if config.save_file.endswith(".shelve"):
+        return ShelveStore(
+            config.save_file, config.save_batch, config.save_interval)
+    return SqliteStore(
+        config.save_file, config.save_batch, config.save_interval)
+
+
+def remove_store(save_file):
+    # SQLite in WAL mode keeps two side files next to the database, a
+    # shelve save file keeps its frontier state in a .meta file and its
+    # downloads in a .fetches shelve, and the frontier saves its seen
+    # filter in a .bloom file.
+    for path in (save_file, f"{save_file}-wal", f"{save_file}-shm",
+                 f"{save_file}.meta", f"{save_file}.bloom",
+                 *glob.glob(f"{glob.escape(save_file)}.fetches*")):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def migrate_shelve(shelve_file, store):
+    ''' Copies every url from an old frontier.shelve file into store. '''
+    count = 0
+    with shelve.open(shelve_file, "r") as old:
+        for urlhash, (url, completed) in old.items():
+            store.put(urlhash, url, completed)
+            count += 1
+    store.flush()
+    return count
+
+
+class GroupCommit(object):
+    ''' Commits writes every batch_size records or every interval seconds,
+    whichever comes first, instead of once per record. '''
+    def __init__(self, batch_size, interval):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def wrote(self):
+        self.pending += 1
+        if (self.pending >= self.batch_size
+                or time.monotonic() - self.last_flush >= self.interval):
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self._commit()
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def _commit(self):
+        raise NotImplementedError
+
+
+class ShelveStore(GroupCommit):
+    def __init__(self, save_file, batch_size, interval):
+        super().__init__(batch_size, interval)
+        self.save = shelve.open(save_file)
+        # Frontier state other than urls lives next to the shelve, so that
+        # values() only ever yields (url, completed) pairs.
+        self.fetches = shelve.open(f"{save_file}.fetches")
+        self.meta_file = f"{save_file}.meta"
+        self.meta = dict()
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file) as file:
+                self.meta = json.load(file)
+
+    def __contains__(self, urlhash):
+        return urlhash in self.save
+
+    def __len__(self):
+        return len(self.save)
+
+    def get(self, urlhash):
+        return self.save.get(urlhash)
+
+    def put(self, urlhash, url, completed):
+        self.save[urlhash] = (url, completed)
+        self.wrote()
+
+    def values(self):
+        return self.save.values()
+
+    def pending_count(self):
+        return sum(1 for url, completed in self.save.values() if not completed)
+
+    def pending_pages(self, page_size):
+        # A shelve has no index to page through, so the pending urls are
+        # read in one go and handed out a page at a time.
+        urls = [url for url, completed in self.save.values() if not completed]
+        for start in range(0, len(urls), page_size):
+            yield urls[start:start + page_size]
+
+    def get_fetch(self, urlhash):
+        return self.fetches.get(urlhash)
+
+    def put_fetch(self, urlhash, digest, fetched_at, revisit, changes):
+        self.fetches[urlhash] = (digest, fetched_at, revisit, changes)
+        self.wrote()
+
+    def mark_due(self, before):
+        due = 0
+        for urlhash, (_, fetched_at, revisit, _) in self.fetches.items():
+            entry = self.save.get(urlhash)
+            if entry and entry[1] and fetched_at + revisit <= before:
+                self.save[urlhash] = (entry[0], False)
+                due += 1
+        self.wrote()
+        self.flush()
+        return due
+
+    def get_meta(self, key):
+        return self.meta.get(key)
+
+    def put_meta(self, key, value):
+        self.meta[key] = value
+        tmp_file = f"{self.meta_file}.tmp"
+        with open(tmp_file, "w") as file:
+            json.dump(self.meta, file)
+        os.replace(tmp_file, self.meta_file)
+
+    def _commit(self):
+        self.save.sync()
+        self.fetches.sync()
+
+    def close(self):
+        self.flush()
+        self.save.close()
+        self.fetches.close()
+
+
+class SqliteStore(GroupCommit):
+    ''' Save file backed by SQLite in WAL mode. Writes go to the database
+    right away but are only committed in groups; after a crash SQLite rolls
+    back to the last commit, so at most one group of url states is lost.
+
+    Triggers keep the number of urls and of pending urls in the counts
+    table, and a partial index holds just the pending urls, so neither
+    counting nor resuming reads the completed ones. Downloaded urls also
+    keep the digest of their content, when they were downloaded, after how
+    many seconds to revisit them and how often they had changed. '''
+    def __init__(self, save_file, batch_size, interval):
+        super().__init__(batch_size, interval)
+        # The frontier serializes access, so the connection can be shared
+        # between worker threads.
+        self.db = sqlite3.connect(save_file, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS urls ("
+            "urlhash TEXT PRIMARY KEY, url TEXT NOT NULL, "
+            "completed INTEGER NOT NULL, digest TEXT, fetched_at REAL, "
+            "revisit REAL, changes INTEGER NOT NULL DEFAULT 0)")
+        columns = {
+            row[1] for row in self.db.execute("PRAGMA table_info(urls)")}
+        for column in ("digest TEXT", "fetched_at REAL", "revisit REAL",
+                       "changes INTEGER NOT NULL DEFAULT 0"):
+            # A save file from before the downloads were kept.
+            if column.split()[0] not in columns:
+                self.db.execute(f"ALTER TABLE urls ADD COLUMN {column}")
+        # Frontier state other than urls, e.g. the trap detector.
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS meta ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS urls_pending ON urls (completed) "
+            "WHERE completed = 0")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS urls_due ON urls (fetched_at + revisit) "
+            "WHERE completed = 1")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS counts ("
+            "name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        if not self.db.execute("SELECT 1 FROM counts").fetchone():
+            # A new database, or one saved before the counts were kept.
+            self.db.execute(
+                "INSERT INTO counts (name, value) "
+                "SELECT 'urls', COUNT(*) FROM urls UNION ALL "
+                "SELECT 'pending', COUNT(*) FROM urls WHERE completed = 0")
+        self.db.execute(
+            "CREATE TRIGGER IF NOT EXISTS urls_inserted AFTER INSERT ON urls "
+            "BEGIN "
+            "UPDATE counts SET value = value + 1 WHERE name = 'urls'; "
+            "UPDATE counts SET value = value + 1 - NEW.completed "
+            "WHERE name = 'pending'; "
+            "END")
+        self.db.execute(
+            "CREATE TRIGGER IF NOT EXISTS urls_updated "
+            "AFTER UPDATE OF completed ON urls "
+            "WHEN OLD.completed != NEW.completed "
+            "BEGIN "
+            "UPDATE counts SET value = value + OLD.completed - NEW.completed "
+            "WHERE name = 'pending'; "
+            "END")
+        self.db.commit()
+
+    def _count(self, name):
+        return self.db.execute(
+            "SELECT value FROM counts WHERE name = ?", (name,)).fetchone()[0]
+
+    def __contains__(self, urlhash):
+        return self.db.execute(
+            "SELECT 1 FROM urls WHERE urlhash = ?", (urlhash,)
+        ).fetchone() is not None
+
+    def __len__(self):
+        return self._count("urls")
+
+    def get(self, urlhash):
+        row = self.db.execute(
+            "SELECT url, completed FROM urls WHERE urlhash = ?", (urlhash,)
+        ).fetchone()
+        return (row[0], bool(row[1])) if row else None
+
+    def put(self, urlhash, url, completed):
+        self.db.execute(
+            "INSERT INTO urls (urlhash, url, completed) VALUES (?, ?, ?) "
+            "ON CONFLICT(urlhash) DO UPDATE SET "
+            "url = excluded.url, completed = excluded.completed",
+            (urlhash, url, int(completed)))
+        self.wrote()
+
+    def values(self):
+        for url, completed in self.db.execute(
+                "SELECT url, completed FROM urls"):
+            yield url, bool(completed)
+
+    def pending_count(self):
+        return self._count("pending")
+
+    def pending_pages(self, page_size):
+        ''' Yields the urls that were pending when it was called, page_size
+        at a time, each page read only when asked for. Urls added later are
+        left out, since the frontier queues those itself. '''
+        end = self.db.execute("SELECT MAX(rowid) FROM urls").fetchone()[0]
+        return self._pending_pages(end or 0, page_size)
+
+    def _pending_pages(self, end, page_size):
+        after = 0
+        while True:
+            rows = self.db.execute(
+                "SELECT rowid, url FROM urls INDEXED BY urls_pending "
+                "WHERE completed = 0 AND rowid > ? AND rowid <= ? "
+                "ORDER BY rowid LIMIT ?", (after, end, page_size)).fetchall()
+            if not rows:
+                return
+            after = rows[-1][0]
+            yield [url for _, url in rows]
+
+    def get_fetch(self, urlhash):
+        ''' (digest, fetched_at, revisit, changes) of the last download of
+        urlhash, or None if it was never downloaded. '''
+        row = self.db.execute(
+            "SELECT digest, fetched_at, revisit, changes FROM urls "
+            "WHERE urlhash = ? AND fetched_at IS NOT NULL", (urlhash,)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def put_fetch(self, urlhash, digest, fetched_at, revisit, changes):
+        self.db.execute(
+            "UPDATE urls SET digest = ?, fetched_at = ?, revisit = ?, "
+            "changes = ? WHERE urlhash = ?",
+            (digest, fetched_at, revisit, changes, urlhash))
+        self.wrote()
+
+    def mark_due(self, before):
+        ''' Marks the downloaded urls due for a revisit before the given
+        time as pending again. Returns how many there were. '''
+        due = self.db.execute(
+            "UPDATE urls SET completed = 0 "
+            "WHERE completed = 1 AND fetched_at + revisit <= ?",
+            (before,)).rowcount
+        self.wrote()
+        self.flush()
+        return due
+
+    def get_meta(self, key):
+        row = self.db.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put_meta(self, key, value):
+        self.db.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value))
+        self.wrote()
+
+    def _commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.flush()
+        self.db.close()
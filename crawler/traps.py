@@ -0,0 +1,117 @@
+import re
+import json
+
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+DIGITS = re.compile(r"\d+")
+# Query parameters that only page through revisions, diffs or edit views
+# of wiki pages and calendars; every value is another copy of a page.
+LOOP_PARAMS = re.compile(
+    r"(?:^|&)(?:do=(?:diff|revisions|backlink|edit|index|media|recent)"
+    r"|action=(?:diff|history|edit|raw|info)"
+    r"|rev2?(?:%5b%5d|\[\])?=|oldid=|diff=|difftype="
+    r"|tribe-bar-date=|eventdisplay=|outlook-ical=)")
+
+
+def url_template(url):
+    ''' host + path with every run of digits replaced by "#", plus the
+    sorted query keys, e.g. www.ics.uci.edu/events/#-#-#?page. '''
+    parsed = urlsplit(url)
+    keys = sorted({pair.split("=", 1)[0] for pair in parsed.query.split("&")
+                   if pair})
+    template = f"{parsed.hostname}{DIGITS.sub('#', parsed.path)}"
+    return f"{template}?{'&'.join(keys)}" if keys else template
+
+
+class BoundedCounts(OrderedDict):
+    ''' Dict of counters that forgets the least recently used keys beyond
+    max_size. '''
+    def __init__(self, max_size, *args):
+        self.max_size = max_size
+        super().__init__(*args)
+
+    def touch(self, key, default):
+        value = self.get(key)
+        if value is None:
+            value = self[key] = default
+            while len(self) > self.max_size:
+                self.popitem(last=False)
+        else:
+            self.move_to_end(key)
+        return value
+
+
+class TrapDetector(object):
+    ''' Decides at frontier admission whether a new url looks like part of
+    a crawler trap:
+    - its query pages through wiki revisions, diffs or calendar views,
+    - its url template already admitted template_budget urls,
+    - its host already admitted host_budget urls,
+    - its path already admitted query_budget distinct queries,
+    - or too many pages fetched for its template were near-duplicates.
+    State is kept in LRU-bounded counters and saved with the frontier. '''
+    def __init__(self, template_budget=500, host_budget=50000,
+                 query_budget=100, max_keys=100000, novelty_pages=20,
+                 duplicate_ratio=0.5):
+        self.template_budget = template_budget
+        self.host_budget = host_budget
+        self.query_budget = query_budget
+        self.max_keys = max_keys
+        self.novelty_pages = novelty_pages
+        self.duplicate_ratio = duplicate_ratio
+        # template -> [admitted, fetched, near-duplicates]
+        self.templates = BoundedCounts(max_keys)
+        # (host + path) -> number of distinct queries admitted
+        self.queries = BoundedCounts(max_keys)
+        self.hosts = dict()
+        self.rejected = dict()
+
+    def _reject(self, reason):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        return False
+
+    def admit(self, url):
+        parsed = urlsplit(url)
+        if parsed.query and LOOP_PARAMS.search(parsed.query.lower()):
+            return self._reject("loop parameter")
+        template = url_template(url)
+        stats = self.templates.touch(template, [0, 0, 0])
+        admitted, fetched, duplicates = stats
+        if admitted >= self.template_budget:
+            return self._reject("template budget")
+        if (fetched >= self.novelty_pages
+                and duplicates >= self.duplicate_ratio * fetched):
+            return self._reject("low novelty")
+        host = parsed.hostname
+        if self.hosts.get(host, 0) >= self.host_budget:
+            return self._reject("host budget")
+        if parsed.query:
+            path = f"{host}{parsed.path}"
+            if self.queries.get(path, 0) >= self.query_budget:
+                return self._reject("query explosion")
+            self.queries.touch(path, 0)
+            self.queries[path] += 1
+        stats[0] += 1
+        self.hosts[host] = self.hosts.get(host, 0) + 1
+        return True
+
+    def record_fetch(self, url):
+        self.templates.touch(url_template(url), [0, 0, 0])[1] += 1
+
+    def record_duplicate(self, url):
+        self.templates.touch(url_template(url), [0, 0, 0])[2] += 1
+
+    def dumps(self):
+        return json.dumps({
+            "templates": list(self.templates.items()),
+            "queries": list(self.queries.items()),
+            "hosts": self.hosts,
+            "rejected": self.rejected})
+
+    def loads(self, data):
+        state = json.loads(data)
+        self.templates = BoundedCounts(self.max_keys, state["templates"])
+        self.queries = BoundedCounts(self.max_keys, state["queries"])
+        self.hosts = state["hosts"]
+        self.rejected = state["rejected"]
@@ -4,7 +4,70 @@ from inspect import getsource
 from utils.download import download
 from utils import get_logger
 import scraper
-import time
+
+
+def check_scraper():
+    # basic check for requests in scraper
+    assert {getsource(scraper).find(req) for req in {"from requests import", "import requests"}} == {-1}, "Do not use requests in scraper.py"
+    assert {getsource(scraper).find(req) for req in {"from urllib.request import", "import urllib.request"}} == {-1}, "Do not use urllib.request in scraper.py"
+
+
+class CrawlTask(object):
+    ''' The work on one url handed out by the frontier, shared by every
+    kind of worker:
+
+        with CrawlTask(frontier, url, logger) as task:
+            resp = download(url, config, logger)
+            task.scrape(resp)
+
+    When the block finishes the url is marked complete. When it raises, the
+    error is logged and the url released instead, so that its host is never
+    left checked out and the url stays pending for the next run. A block
+    that passes the url on to another stage calls hand_on(), and that stage
+    finishes it with a CrawlTask of its own. '''
+    def __init__(self, frontier, url, logger):
+        self.frontier = frontier
+        self.url = url
+        self.logger = logger
+        self.handed_on = False
+
+    def __enter__(self):
+        return self
+
+    def changed(self, resp):
+        ''' Reports resp to the frontier. False if the page did not change
+        since it was last downloaded: its links were added then, so it need
+        not be parsed. '''
+        return self.frontier.record_response(self.url, resp)
+
+    def scrape(self, resp):
+        if self.changed(resp):
+            self.add_links(scraper.scraper(self.url, resp))
+
+    def add_links(self, links):
+        for link in links:
+            self.frontier.add_url(link)
+
+    def hand_on(self):
+        self.handed_on = True
+
+    def __exit__(self, kind, error, traceback):
+        if kind is None and self.handed_on:
+            return False
+        if kind is None:
+            try:
+                self.frontier.mark_url_complete(self.url)
+                return False
+            except Exception as e:
+                kind, error = type(e), e
+        try:
+            if issubclass(kind, Exception):
+                self.logger.error(f"Failed to crawl {self.url}: {error}")
+        finally:
+            self.frontier.release_url(self.url)
+        # Errors end this url only; anything else, e.g. KeyboardInterrupt,
+        # goes on up.
+        return issubclass(kind, Exception)
 
 
 class Worker(Thread):
@@ -12,23 +75,18 @@ class Worker(Thread):
         self.logger = get_logger(f"Worker-{worker_id}", "Worker")
         self.config = config
         self.frontier = frontier
-        # basic check for requests in scraper
-        assert {getsource(scraper).find(req) for req in {"from requests import", "import requests"}} == {-1}, "Do not use requests in scraper.py"
-        assert {getsource(scraper).find(req) for req in {"from urllib.request import", "import urllib.request"}} == {-1}, "Do not use urllib.request in scraper.py"
+        check_scraper()
         super().__init__(daemon=True)
-        
+
     def run(self):
         while True:
             tbd_url = self.frontier.get_tbd_url()
             if not tbd_url:
                 self.logger.info("Frontier is empty. Stopping Crawler.")
                 break
-            resp = download(tbd_url, self.config, self.logger)
-            self.logger.info(
-                f"Downloaded {tbd_url}, status <{resp.status}>, "
-                f"using cache {self.config.cache_server}.")
-            scraped_urls = scraper.scraper(tbd_url, resp)
-            for scraped_url in scraped_urls:
-                self.frontier.add_url(scraped_url)
-            self.frontier.mark_url_complete(tbd_url)
-            time.sleep(self.config.time_delay)
+            with CrawlTask(self.frontier, tbd_url, self.logger) as task:
+                resp = download(tbd_url, self.config, self.logger)
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server}.")
+                task.scrape(resp)
@@ -4,20 +4,80 @@ from argparse import ArgumentParser
 from utils.server_registration import get_cache_server
 from utils.config import Config
 from crawler import Crawler
+from crawler.worker import Worker
+from crawler.async_worker import AsyncWorker
+from crawler.shards import ShardedCrawler
+from crawler.pipeline import PipelineCrawler
+from crawler.store import get_store, migrate_shelve
 
 
-def main(config_file, restart):
+def migrate(config, shelve_file):
+    store = get_store(config)
+    count = migrate_shelve(shelve_file, store)
+    store.close()
+    print(f"Migrated {count} urls from {shelve_file} to {config.save_file}.")
+
+
+def main(config_file, restart, migrate_from=None, async_download=False,
+         processes=1, pipeline=False, record_corpus=None, recrawl=False):
     cparser = ConfigParser()
     cparser.read(config_file)
     config = Config(cparser)
+    config.recrawl = recrawl
+    if migrate_from:
+        migrate(config, migrate_from)
     config.cache_server = get_cache_server(config, restart)
-    crawler = Crawler(config, restart)
-    crawler.start()
+    proxy = None
+    if record_corpus:
+        from bench.corpus import RecordingProxy
+        proxy = RecordingProxy(config.cache_server, record_corpus).start()
+        config.cache_server = proxy.address
+    worker_factory = AsyncWorker if async_download else Worker
+    if pipeline:
+        crawler = PipelineCrawler(config, restart)
+    elif processes > 1:
+        crawler = ShardedCrawler(config, restart, processes, worker_factory)
+    else:
+        crawler = Crawler(config, restart, worker_factory=worker_factory)
+    try:
+        crawler.start()
+    finally:
+        if proxy is not None:
+            proxy.stop()
+            print(f"Recorded {proxy.writer.count} pages to {record_corpus}.")
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--restart", action="store_true", default=False)
     parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument(
+        "--migrate_shelve", type=str, default=None,
+        help="Copy an old frontier.shelve save file into SAVE before starting.")
+    parser.add_argument(
+        "--async_download", action="store_true", default=False,
+        help="Run each worker as an asyncio loop with CONCURRENCY downloads "
+             "in flight.")
+    parser.add_argument(
+        "--processes", type=int, default=1,
+        help="Crawl with this many processes, each owning the hosts that "
+             "hash to it.")
+    parser.add_argument(
+        "--pipeline", action="store_true", default=False,
+        help="Download with THREADCOUNT threads and parse in PARSERS "
+             "processes at the same time.")
+    parser.add_argument(
+        "--record_corpus", type=str, default=None,
+        help="Append every page the cache server sends to this corpus file, "
+             "for python -m bench.replay.")
+    parser.add_argument(
+        "--recrawl", action="store_true", default=False,
+        help="Download the pages of the save file that are due for a "
+             "revisit again, parsing only the ones that changed.")
     args = parser.parse_args()
-    main(args.config_file, args.restart)
+    if args.recrawl and args.restart:
+        parser.error("--recrawl revisits the save file, which --restart "
+                     "deletes.")
+    main(args.config_file, args.restart, args.migrate_shelve,
+         args.async_download, args.processes, args.pipeline,
+         args.record_corpus, args.recrawl)
@@ -1,14 +1,30 @@
-import re
+import time
 from urllib.parse import urlparse, urljoin
-from bs4 import BeautifulSoup
-
-visited = {} # keep track of visited pages for similarity detection 
-# keep track of unqiue pages - Uniqueness for the purposes of this assignment is ONLY established by the URL, but discarding the fragment part. So, for example, http://www.ics.uci.edu#aaa and http://www.ics.uci.edu#bbb are the same URL
-unique_pages = set()
-# keep track of the longest page in terms of the number of words (HTML markup doesn't count as words)
-longest_page = {"url": "", "word_count": 0}
-# keep track of the 50 most common words ordered by its frequency - ignore english stop words
-common_words = {}
+from utils.extract import extract
+from utils.simhash import simhash
+from utils.tokenizer import Tokenizer
+from utils.url_policy import UrlPolicy
+from utils.canonical import canonicalize
+from utils.crawl_state import CrawlState
+from utils import metrics
+
+# everything the scraper updates while crawling, shared by all the worker threads without one global lock (utils/crawl_state.py):
+# - state.near_duplicates: the SimHash fingerprints of crawled pages for near-duplicate detection across the whole crawl (NEARDUPDISTANCE and NEARDUPFINGERPRINTS in config.ini)
+# - state.near_duplicate_listeners: called with the URL of every near-duplicate page - the frontier's trap detector listens to find URL patterns that keep producing the same content
+# - state.analytics: per-thread report counters merged when unique_pages.txt, longest_page.txt, most_common_words.txt and subdomains.txt are rewritten every few hundred pages
+#   - unique pages: Uniqueness for the purposes of this assignment is ONLY established by the URL, but discarding the fragment part. So, for example, http://www.ics.uci.edu#aaa and http://www.ics.uci.edu#bbb are the same URL
+#   - longest page in terms of the number of words (HTML markup doesn't count as words)
+#   - the 50 most common words ordered by its frequency - ignore english stop words
+#   - subdomains in the ics.uci.edu domain ordered alphabetically with the number of unique pages detected in each
+# - state.writer: the one thread that writes the token log (TOKENLOG in config.ini, read it back with utils/tokenlog.py) and the report files
+# - state.max_page_bytes: the most bytes of a page that are parsed, larger pages are truncated (MAXPAGEBYTES in config.ini)
+state = CrawlState()
+# how long pages take to parse and tokenize, how many links they have, how many links canonicalization rewrote and how many pages were near-duplicates (utils/metrics.py)
+parse_seconds = metrics.histogram("scraper_parse_seconds", "Time to parse a page, tokenizing included.")
+tokenize_seconds = metrics.histogram("scraper_tokenize_seconds", "Time to tokenize the text of a page.")
+links_per_page = metrics.histogram("scraper_links_per_page", "Valid links found on a page.", metrics.SIZE_BUCKETS)
+canonicalized_links = metrics.counter("scraper_canonicalized_links_total", "Valid links canonicalization rewrote, which the old normalization would have queued as another url.")
+near_duplicate_pages = metrics.counter("scraper_near_duplicate_pages_total", "Pages skipped as near-duplicates of an earlier page.")
 # stop words to ignore 
 stop_words = [
     "a", "about", "above", "after", "again", "against", "all", "am", "an", "and",
@@ -28,12 +44,29 @@ stop_words = [
     "when's", "where", "where's", "which", "while", "who", "who's", "whom", "why", "why's", "with", "won't", "would",
     "wouldn't", "you", "you'd", "you'll", "you're", "you've", "your", "yours", "yourself", "yourselves"
 ]
-# keep track of the subdomains you find in the ics.uci.edu domain - list of subdomains ordered alphabetically and the number of uniques pages detected in each subdomain. the content of this list should be lines containing URL, number for example: http://vision.ics.uci.edu, 10
-subdomains = {}
-sorted_subdomains = {}
-
-# scheme + path count 
-relative_count = {}
+# counts tokens and then drops the stop words found on the page through a set, instead of searching the list above for every token - nothing is interned, so memory does not grow with every new word the crawl meets (utils/tokenizer.py)
+tokenizer = Tokenizer(stop_words)
+# redirect status codes - the cache server normally follows redirects itself, so these only come back when it did not
+redirect_statuses = {301, 302, 303, 307, 308}
+# the rules is_valid checks, compiled once
+url_policy = UrlPolicy(
+    # make sure to return only URLs that are within the domains and paths specified
+    domains=["ics.uci.edu", "cs.uci.edu", "informatics.uci.edu", "stat.uci.edu"],
+    # if a URL's query contains action=download or ical, return False 
+    denied_queries=["action=download", "action=upload", "ical=1"],
+    # if a URL's path contains '/wp-content/uploads' or pdf, return False 
+    denied_paths=["/wp-content/uploads", "pdf"],
+    # modified to ensure we are only crawling URLs that are web pages and not files
+    extensions=[
+        "css", "js", "bmp", "gif", "jpg", "jpeg", "ico",
+        "png", "tif", "tiff", "mid", "mp2", "mp3", "mp4",
+        "wav", "avi", "mov", "mpeg", "ram", "m4v", "mkv", "ogg", "ogv", "pdf",
+        "ps", "eps", "tex", "ppt", "pptx", "doc", "docx", "xls", "xlsx", "names",
+        "data", "dat", "exe", "bz2", "tar", "msi", "bin", "7z", "psd", "dmg", "iso",
+        "epub", "dll", "cnf", "tgz", "sha1",
+        "thmx", "mso", "arff", "rtf", "jar", "csv",
+        "txt", "ppsx", "war", "r", "bib", "mat", "m", "uai", "java", "py", "scm", "rkt", "ss", "sql", "odc", "img",
+        "rm", "smil", "wmv", "swf", "wma", "zip", "rar", "gz"])
 
 # receives a URL and corresponding web response for example, "http://www.ics.uci.edu" and the web response will contain the page itself 
 def scraper(url, resp):
@@ -51,134 +84,172 @@ def extract_next_links(url, resp):
     #         resp.raw_response.content: the content of the page!
     # Return a list with the hyperlinks (as strings) scrapped from resp.raw_response.content
 
-    global unique_pages, longest_page, common_words, stop_words, subdomains, sorted_subdomains, relative_count 
-    # store hyperlinks scrapped from resp.raw_response.content
-    links = []
+    # parsing only reads the response, so the pipelined crawler (crawler/pipeline.py) runs parse_page in other processes and record_page in one place
+    return record_page(url, parse_page(url, resp))
+
+# what parse_page finds in a page - tokens is None when the page was not parsed
+class ParsedPage(object):
+    def __init__(self):
+        self.skipped = []
+        # the canonical URL the page actually came from when the request was redirected
+        self.redirect = None
+        self.tokens = None
+        self.fingerprint = None
+        self.word_counts = None
+        self.links = []
+        # how many of links canonicalization changed beyond dropping the fragment and trailing slash
+        self.canonicalized = 0
+        # seconds spent parsing and tokenizing, measured where the page was parsed - possibly another process
+        self.parse_seconds = None
+        self.tokenize_seconds = None
+
+def parse_page(url, resp):
+    # parses the page without touching any of the crawl state above
+    page = ParsedPage()
+    started = time.perf_counter()
+
+    # tokenizes like tokenize, timing it
+    def timed_tokenize(text):
+        tokenize_started = time.perf_counter()
+        tokens = tokenize(text)
+        page.tokenize_seconds = time.perf_counter() - tokenize_started
+        return tokens
 
     try: 
         # if the status code is 200 and the url is valid 
         if resp.status == 200 and is_valid(url):
             # Detect and avoid dead URLs that return a 200 status but no data (204 No Content)
-            if resp.status == 204 or resp.raw_response.content == "":
+            if resp.status == 204 or not resp.raw_response.content:
                 print("The page is empty.")
-                return links
+                page.skipped.append("empty")
+                return page
+
+            # skip files that are not web pages, judging by the Content-Type header before anything is parsed
+            content_type = resp.content_type
+            if content_type and "html" not in content_type:
+                page.skipped.append("not html")
+                return page
+
+            # detect redirects: the cache server follows them, and resp.raw_response.url is where the page actually came from
+            # the redirected content is indexed under that URL, as long as it is one we would crawl
+            final_url = getattr(resp.raw_response, "url", None) or url
+            if canonicalize(final_url) != canonicalize(url):
+                if not is_valid(canonicalize(final_url)):
+                    page.skipped.append("redirected away")
+                    return page
+                page.redirect = canonicalize(final_url)
+
+            # Detect and avoid crawling very large files, especially if they have low information value - only the first max_page_bytes are parsed, whatever Content-Length said
+            content = resp.raw_response.content
+            if len(content) > state.max_page_bytes:
+                content = content[:state.max_page_bytes]
+                page.skipped.append("truncated")
+
+            # walk the document once: "Good Content" text outside navbars, headers and footers, every hyperlink, and the tokens of the text - decoded with the charset the server sent, else the page's <meta> charset, else UTF-8
+            extracted = extract(content, timed_tokenize, resp.charset)
+            page.tokens = extracted.tokens
+            # fingerprint the page for near-duplicate detection
+            page.fingerprint = simhash(page.tokens)
+            # count occurrences of words in the content, without stop words
+            page.word_counts = tokenizer.count_words(page.tokens)
 
-            # Detect and avoid crawling very large files, especially if they have low information value
+            # crawling/scrapping - find all the hyperlinks in the page
+            for link in extracted.links:
+                # transform relative URLs to absolute URLs - resolve the link against the URL the page came from (with its trailing slash, after any redirect)
+                # then canonicalize it: lowercase host, no default port, fragment, trailing slash, index page or tracking parameters, sorted query
+                resolved = urljoin(final_url, link).split("#")[0].rstrip("/")
+                link = canonicalize(resolved)
 
-            content = resp.raw_response.content
-            soup = BeautifulSoup(content, "html.parser")
-            # filter out tags for "Good Content" of the page - removes hyperlinks, navbars, footers, etc.
-            filtered_tags = soup.find_all(lambda tag: tag.name in ['title', 'p', 'h1', 'h2', 'h3', 'ul', 'ol', 'li', 'table', 'tr', 'td'] and not any(parent.name in ['nav', 'header', 'footer'] for parent in tag.parents))
-
-            # get the text from filtered_tags
-            text = " ".join([tag.get_text() for tag in filtered_tags])
-
-            # tokenize the text and put the url and the tokens in a text file 
-            tokens = tokenize(text)
-            # store the tokens in a text file
-            with open("tokens.txt", "a") as file:
-                file.write("URL: " + url + "\n")
-                file.write("Tokens: ")
-                for token in tokens:
-                    file.write(token + ", ")
-                file.write("\n")
-
-            # Check if visited dictionary is not empty
-            if visited:
-                # Get the last key of the dictionary
-                last_key = list(visited.keys())[-1]
-                if url.rsplit('/', 1)[0] + "/" == last_key.rsplit('/', 1)[0] + "/" and is_similar_fingerprint(text, visited[last_key]):
-                    return links
-            else:
-                print("Visited dictionary is empty, cannot compare with the last visited page.")
+                # make sure crawler doesn't fall into a trap of infinite loops - the resolved link is checked once, and scraper() gets the cached verdict
+                if is_valid(link):
+                    page.links.append(link)
+                    # the frontier only ever sees canonical links, so the links canonicalization kept from being downloaded twice are counted here
+                    if link != resolved:
+                        page.canonicalized += 1
+
+            page.parse_seconds = time.perf_counter() - started
+        
+        # a redirect the cache server did not follow - its target is queued like any other link, and indexed once it is downloaded
+        elif resp.status in redirect_statuses and resp.raw_response is not None:
+            print("The page is a redirect.")
+            location = resp.raw_response.headers.get("Location")
+            if location:
+                target = canonicalize(urljoin(url, location))
+                if target != canonicalize(url) and is_valid(target):
+                    page.links.append(target)
+
+    except Exception as e: 
+        print("An error occurred while links were extracted: ", e)
+
+    return page
+
+def record_page(url, page):
+    # updates the crawl state with a parsed page and returns its links
+    # store hyperlinks scrapped from resp.raw_response.content
+    links = []
+
+    try:
+        for reason in page.skipped:
+            state.analytics.count_skip(reason)
+
+        if page.parse_seconds is not None:
+            parse_seconds.observe(page.parse_seconds)
+            tokenize_seconds.observe(page.tokenize_seconds)
+            links_per_page.observe(len(page.links))
+            canonicalized_links.inc(page.canonicalized)
+
+        # the content of a redirected page belongs to the URL it came from - the frontier marks that URL as downloaded and rewrites later links to url
+        page_url = url
+        if page.redirect is not None:
+            for listener in state.redirect_listeners:
+                listener(url, page.redirect)
+            page_url = page.redirect
+
+        if page.tokens is not None:
+            # store the tokens in the binary token log - queued for the writer thread so pages from different threads never interleave
+            state.log_tokens(page_url, page.tokens)
+
+            # skip pages that are near-identical to any page crawled before
+            if state.is_near_duplicate(page.fingerprint):
+                near_duplicate_pages.inc()
+                for listener in state.near_duplicate_listeners:
+                    listener(url)
+                return links
 
             # count occurrences of words in the content
-            words = [word.lower() for word in tokenize(text) if word.lower() not in stop_words]
-            # update common_words dictionary
-            for word in words:
-                common_words[word] = common_words.get(word, 0) + 1
+            state.analytics.count_words(page.word_counts)
+
+            # the page itself is a unique page too when it was redirected - its final URL may never appear as a link
+            if page.redirect is not None:
+                state.analytics.add_unique_page(page_url)
 
             # extract subdomain from the URL
-            subdomain = urlparse(url).hostname
-            # update subdomains dictionary
+            subdomain = urlparse(page_url).hostname
+            # update subdomains count
             if subdomain.endswith(".ics.uci.edu"):
-                subdomains[subdomain] = subdomains.get(subdomain, 0) + 1
-            # get subdomains ordered alphabetically
-            sorted_subdomains = sorted(subdomains.items(), key=lambda x: x[0])
-
-            current_page_length = len(tokenize(text))
-            # compare the current page length with whats in the longest_page's word_count
-            if current_page_length > longest_page['word_count']:
-                longest_page['url'] = url
-                longest_page['word_count'] = current_page_length
-
-            # count the relative path of the URL for trap detection 
-            relative = url.rsplit('/', 1)[0] + "/"
-            relative_count[relative] = relative_count.get(relative, 0) + 1
-            if relative_count[relative] > 40: 
-                return links 
+                state.analytics.count_subdomain(subdomain)
 
-            # crawling/scrapping - find all the hyperlinks in the page
-            for tag in soup.find_all('a', href=True):
-                # make sure crawler doesn't fall into a trap of infinite loops
-                link = tag.get('href')
+            # compare the current page length with the longest page's word_count
+            state.analytics.update_longest_page(page_url, len(page.tokens))
 
-                if is_valid(link):
-            
-                    # transform relative URLs to absolute URLs - if the link is a relative URL, append it to the base URL
-                    if link.startswith("/"):
-                        link = urljoin(url, link)
-                    elif link.startswith(("http", "https")):
-                        link = link
-                    else:
-                        link = urljoin(url, "/" + link)
-
-                    # defragment the URL only if the fragment exists and add it to the unique URLs list
-                    if "#" in link:
-                        link = link.split("#")[0]
-                        unique_pages.add(link)
-                        links.append(link)
-                        visited[link] = text
-
-                    # if the page doesn't have a fragment, you still add it to the unique URLs list
-                    else:
-                        unique_pages.add(link)
-                        links.append(link)
-                        visited[link] = text
-        
-        # detect redirects and if the page redirects your crawler, index the redirected content
-        # go into the content of the redirected page
-        # anything that starts with 3 is a redirect
-        elif resp.status == 301 or resp.status == 302:
-            print("The page is a redirect.")
-            # if the page is a redirect, index the redirected content
-            redirected_url = resp.raw_response.url
-            redirected_content = resp.raw_response.content
-            soup = BeautifulSoup(redirected_content, "html.parser")
-
-        # write unique_pages and the total number of unique pages to a txt file
-        with open("unique_pages.txt", "w") as file:
-            for page in unique_pages:
-                file.write(page + "\n")
-            file.write("Total Unique Pages: " + str(len(unique_pages)))
-
-        # write longest page's url and word_count to a txt file
-        with open("longest_page.txt", "w") as file:
-            file.write("Longest Page: " + longest_page['url'] + "\n")
-            file.write("Word Count: " + str(longest_page['word_count']))
-
-        # write most common words to a text file 
-        with open("most_common_words.txt", "w") as file:
-            for word, count in sorted(common_words.items(), key=lambda x: x[1], reverse=True)[:50]:
-                file.write(word + ": " + str(count) + "\n")
-
-        # write subdomains to a txt file
-        with open("subdomains.txt", "w") as file:
-            for subdomain, count in sorted_subdomains:
-                file.write(subdomain + ": " + str(count) + "\n")
+            # crawler traps are rejected before download by the frontier's trap detector (crawler/traps.py)
+
+            for link in page.links:
+                # the canonical URL is already defragmented - add it to the unique URLs list
+                state.analytics.add_unique_page(link)
+                links.append(link)
+
+        # a redirect that was not followed - its target is the only link
+        elif page.links:
+            for link in page.links:
+                state.analytics.add_unique_page(link)
+                links.append(link)
+
+        # rewrite the report files if a snapshot is due
+        state.analytics.page_done()
 
     except Exception as e: 
-        print("An error occurred while links were extracted: ", e)
+        print("An error occurred while the page was recorded: ", e)
 
     # return the list of scrapped hyperlinks 
     return links
@@ -186,91 +257,11 @@ def extract_next_links(url, resp):
 def is_valid(url):
     # Decide whether to crawl this url or not. 
     # If you decide to crawl it, return True; otherwise return False.
-    # There are already some conditions that return False.
-    try:
-        parsed = urlparse(url)
-        if parsed.scheme not in set(["http", "https"]):
-            return False
-
-        # make sure to return only URLs that are within the domains and paths specified
-        netloc = parsed.netloc
-        allowed_domains = [".ics.uci.edu", ".cs.uci.edu", ".informatics.uci.edu", ".stat.uci.edu"]
-        if not any(domain in netloc for domain in allowed_domains):
-            return False
-
-        # if a URL's query contains action=download or ical, return False 
-        if "action=download" in parsed.query:
-            return False
-
-        if "action=upload" in parsed.query: 
-            return False
-
-        if "ical=1" in parsed.query:
-            return False 
-            
-        # if a URL's path contains '/wp-content/uploads', return False 
-        if "/wp-content/uploads" in parsed.path:
-            return False
-
-        if "pdf" in parsed.path: 
-            return False 
-
-        # modified to ensure we are only crawling URLs that are web pages and not files
-        return not re.match(
-            r".*\.(css|js|bmp|gif|jpe?g|ico"
-            + r"|png|tiff?|mid|mp2|mp3|mp4"
-            + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
-            + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
-            + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
-            + r"|epub|dll|cnf|tgz|sha1"
-            + r"|thmx|mso|arff|rtf|jar|csv"
-            + r"|txt|ppsx|war|r|bib|mat|m|uai|java|py|scm|rkt|ss|sql|odc|img"
-            + r"|rm|smil|wmv|swf|wma|zip|rar|gz)$", parsed.path.lower())
-
-    except TypeError:
-        print ("TypeError for ", parsed)
-        raise
+    # The rules are compiled once in url_policy, and verdicts are cached since the same links appear on many pages.
+    return url_policy.is_valid(url)
 
 # tokenizes the text 
 def tokenize(text):
-    # lowercase all words to be independent of capitalization
-    text = text.lower()
-    # exclude periods at the end of sentences but include them in abbreviations
-    tokens = re.findall(r"(?:\w+\.\w+|\w+['’]\w+|\w+)", text)
+    # lowercase all words to be independent of capitalization, and exclude periods at the end of sentences but include them in abbreviations
     # return the list of "tokens" that are found from the text
-    return tokens
-
-# fingerprint function for similarity between two pages
-def is_similar_fingerprint(page1_text, page2_text, n=3, threshold=15):
-    # tokenize the text
-    page1_tokens = tokenize(page1_text)
-    page2_tokens = tokenize(page2_text)
-
-    # create a set of n-grams for each page
-    page1_ngrams = set()
-    page2_ngrams = set()
-    for i in range(len(page1_tokens) - n + 1):
-        ngram = tuple(page1_tokens[i:i+n])
-        page1_ngrams.add(ngram)
-    for i in range(len(page2_tokens) - n + 1):
-        ngram = tuple(page2_tokens[i:i+n])
-        page2_ngrams.add(ngram)
-
-    # hash n-grams
-    hashed_page1_ngrams = set(hash(ngram) for ngram in page1_ngrams)
-    hashed_page2_ngrams = set(hash(ngram) for ngram in page2_ngrams)
-
-    # select hashes using H mod 4 = 0
-    selected_hashes_page1 = set(hash_value for hash_value in hashed_page1_ngrams if hash_value % 4 == 0)
-    selected_hashes_page2 = set(hash_value for hash_value in hashed_page2_ngrams if hash_value % 4 == 0)
-
-    # if the pages have no selected hashes in common, they are not similar
-    if len(selected_hashes_page1.union(selected_hashes_page2)) == 0: 
-        return False 
-
-    # compare documents using the overlap of fingerprints
-    common_hashes = selected_hashes_page1.intersection(selected_hashes_page2)
-    similarity = len(common_hashes) / len(selected_hashes_page1.union(selected_hashes_page2)) * 100
-
-    # return true if the similarity is greater than the threshold
-    return similarity >= threshold
+    return tokenizer.tokenize(text)
@@ -0,0 +1,159 @@
+''' utils.extract against the BeautifulSoup find_all path it replaced.
+
+    python -m unittest tests.test_extract
+'''
+import unittest
+
+from collections import Counter
+from unittest import mock
+
+import utils.extract
+from bench.extract import BeautifulSoup, legacy_extract
+from utils.extract import extract
+from utils.tokenizer import Tokenizer
+
+tokenize = Tokenizer().tokenize
+
+# Flat content: no content tag inside another, so the old path counted every
+# word once too.
+FLAT_PAGE = b"""<!DOCTYPE html>
+<html>
+<head>
+  <title>Department of Informatics</title>
+  <meta charset="utf-8">
+  <script>var tracking = "not content";</script>
+  <style>p { color: red; }</style>
+</head>
+<body>
+  <header><p>Skip to main content</p><a href="/">Home</a></header>
+  <nav><a href="/about/">About</a> <a href="/people">People</a></nav>
+  <h1>Research Areas</h1>
+  <p>We study human-computer interaction, e.g. ubiquitous computing, and
+  the department's software engineering group.</p>
+  <h2>Contact</h2>
+  <p>Write to <a href="mailto:info@ics.uci.edu">info</a> or visit
+  <a href="https://www.ics.uci.edu/contact#map">the office</a>.</p>
+  <div>Text outside content tags is ignored.</div>
+  <a name="anchor-without-href">anchor</a>
+  <footer><p>Copyright 2019 UC Irvine</p><a href="/privacy">Privacy</a></footer>
+</body>
+</html>
+"""
+
+# Lists and tables nest content tags; the old path repeated their text once
+# per enclosing tag.
+NESTED_PAGE = b"""<html><body>
+<ul>
+  <li> Machine learning </li>
+  <li> Databases <a href="databases.html?utm_source=list">more</a> </li>
+</ul>
+<table>
+  <tr> <td> Faculty </td> <td> Staff </td> </tr>
+  <tr> <td> <a href="../people/faculty">Faculty list</a> </td> </tr>
+</table>
+<ol><li> Unclosed item <li> Another item </ol>
+</body></html>
+"""
+
+# UTF-8 without a <meta> charset, as when the charset is only in the HTTP
+# header or nowhere at all.
+NON_ASCII_PAGE = """<html><body>
+<h1>Résumé workshop</h1>
+<p>We don’t study café naïve Bayes — we study Zürich’s 数据 sets.</p>
+<a href="/événements">Événements</a>
+</body></html>
+""".encode("utf-8")
+
+PAGES = [FLAT_PAGE, NESTED_PAGE, NON_ASCII_PAGE]
+
+
+def stdlib_extract(content, tokenize, encoding=None):
+    with mock.patch.object(utils.extract, "etree", None):
+        return extract(content, tokenize, encoding)
+
+
+def backends():
+    backends = [("html.parser", stdlib_extract)]
+    if utils.extract.etree is not None:
+        backends.append(("lxml", extract))
+    return backends
+
+
+@unittest.skipIf(BeautifulSoup is None, "bs4 is not installed")
+class ExtractParityTest(unittest.TestCase):
+    def test_links_match(self):
+        for content in PAGES:
+            expected = legacy_extract(content, tokenize).links
+            for name, run in backends():
+                with self.subTest(backend=name):
+                    self.assertEqual(run(content, tokenize).links, expected)
+
+    def test_token_sets_match(self):
+        for content in PAGES:
+            expected = set(legacy_extract(content, tokenize).tokens)
+            for name, run in backends():
+                with self.subTest(backend=name):
+                    self.assertEqual(
+                        set(run(content, tokenize).tokens), expected)
+
+    def test_flat_page_token_counts_match(self):
+        expected = Counter(legacy_extract(FLAT_PAGE, tokenize).tokens)
+        for name, run in backends():
+            with self.subTest(backend=name):
+                self.assertEqual(
+                    Counter(run(FLAT_PAGE, tokenize).tokens), expected)
+
+    def test_nested_text_counted_once(self):
+        for name, run in backends():
+            with self.subTest(backend=name):
+                counts = Counter(run(NESTED_PAGE, tokenize).tokens)
+                self.assertEqual(counts["databases"], 1)
+                self.assertEqual(counts["faculty"], 2)
+                self.assertEqual(counts["another"], 1)
+
+
+class ExtractTest(unittest.TestCase):
+    def test_utf8_without_charset(self):
+        for name, run in backends():
+            with self.subTest(backend=name):
+                tokens = run(NON_ASCII_PAGE, tokenize).tokens
+                for word in ("résumé", "don’t", "café", "naïve", "数据"):
+                    self.assertIn(word, tokens)
+
+    def test_charset_from_header(self):
+        content = "<p>Café crème</p>".encode("windows-1252")
+        for name, run in backends():
+            with self.subTest(backend=name):
+                self.assertEqual(
+                    run(content, tokenize, "windows-1252").tokens,
+                    ["café", "crème"])
+
+    def test_charset_from_meta(self):
+        content = ('<html><head><meta charset="iso-8859-1"></head>'
+                   '<body><p>Café crème</p></body></html>').encode("latin-1")
+        for name, run in backends():
+            with self.subTest(backend=name):
+                self.assertEqual(
+                    run(content, tokenize).tokens, ["café", "crème"])
+
+    def test_unknown_charset_falls_back_to_utf8(self):
+        content = "<p>Café</p>".encode("utf-8")
+        for name, run in backends():
+            with self.subTest(backend=name):
+                self.assertEqual(
+                    run(content, tokenize, "x-unknown").tokens, ["café"])
+
+    def test_empty_page(self):
+        page = extract(b"", tokenize)
+        self.assertEqual((page.text, page.links, page.tokens), ("", [], []))
+
+    def test_boilerplate_and_scripts_are_not_content(self):
+        tokens = set(extract(FLAT_PAGE, tokenize).tokens)
+        for word in ("skip", "copyright", "tracking", "color", "outside"):
+            self.assertNotIn(word, tokens)
+        self.assertIn("e.g", tokens)
+        self.assertIn("department's", tokens)
+
+
+if __name__ == "__main__":
+    unittest.main()
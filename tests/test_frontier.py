@@ -0,0 +1,55 @@
+''' crawler.frontier handing urls out and taking them back.
+
+    python -m unittest tests.test_frontier
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+from bench import make_config
+from crawler.frontier import Frontier
+from utils import get_urlhash
+
+SEED = "https://www.ics.uci.edu/about"
+
+
+class FrontierTest(unittest.TestCase):
+    def setUp(self):
+        # The frontier logs to Logs/ under the working directory.
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        self.config = make_config(None, {
+            ("CRAWLER", "SEEDURL"): SEED,
+            ("CRAWLER", "POLITENESS"): 0,
+            ("LOCAL PROPERTIES", "SAVE"): os.path.join(self.dir, "frontier.db"),
+        })
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def test_none_once_failed_url_is_released(self):
+        frontier = Frontier(self.config, True)
+        try:
+            self.assertEqual(frontier.get_tbd_url(), SEED)
+            frontier.release_url(SEED)
+            # Nothing is queued or in flight, so this must not wait.
+            self.assertIsNone(frontier.get_tbd_url())
+            self.assertEqual(frontier.in_flight, 0)
+            self.assertIsNone(frontier.save.get_fetch(get_urlhash(SEED)))
+        finally:
+            frontier.close()
+        # The released url is still pending for the next run.
+        frontier = Frontier(self.config, False)
+        try:
+            self.assertEqual(
+                frontier.save.get(get_urlhash(SEED)), (SEED, False))
+            self.assertEqual(frontier.get_tbd_url(), SEED)
+        finally:
+            frontier.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+''' crawler.store's SQLite save file: its commits, counts and migration.
+
+    python -m unittest tests.test_store
+'''
+import os
+import shelve
+import shutil
+import tempfile
+import unittest
+
+from crawler.store import SqliteStore, migrate_shelve
+from utils import get_urlhash
+
+URLS = [f"https://www.ics.uci.edu/p{i}" for i in range(10)]
+
+
+class SqliteStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.save_file = os.path.join(self.dir, "frontier.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def open(self, batch_size=1000, interval=3600):
+        return SqliteStore(self.save_file, batch_size, interval)
+
+    def assertCountsMatch(self, store):
+        urls, pending = store.db.execute(
+            "SELECT COUNT(*), COUNT(*) - SUM(completed) FROM urls").fetchone()
+        self.assertEqual(len(store), urls)
+        self.assertEqual(store.pending_count(), pending or 0)
+
+    def test_reopen_after_uncommitted_batch(self):
+        store = self.open(batch_size=5)
+        for url in URLS[:7]:
+            store.put(get_urlhash(url), url, False)
+        # The first five were committed as a batch, the last two were not
+        # when the crawler died.
+        store.db.close()
+        store = self.open()
+        self.assertEqual(len(store), 5)
+        self.assertEqual(store.pending_count(), 5)
+        for url in URLS[:5]:
+            self.assertEqual(store.get(get_urlhash(url)), (url, False))
+        for url in URLS[5:7]:
+            self.assertNotIn(get_urlhash(url), store)
+        self.assertCountsMatch(store)
+        store.close()
+
+    def test_counts_follow_the_triggers(self):
+        store = self.open()
+        self.assertCountsMatch(store)
+        for i, url in enumerate(URLS):
+            store.put(get_urlhash(url), url, i % 3 == 0)
+        self.assertCountsMatch(store)
+        for url in URLS[:6]:
+            store.put(get_urlhash(url), url, True)
+        # Writing a url again without changing it counts nothing.
+        store.put(get_urlhash(URLS[0]), URLS[0], True)
+        store.put(get_urlhash(URLS[9]), URLS[9], True)
+        self.assertCountsMatch(store)
+        self.assertEqual(store.pending_count(), 2)
+        for url in URLS[:4]:
+            store.put_fetch(get_urlhash(url), "digest", 100.0, 10.0, 0)
+        self.assertEqual(store.mark_due(105.0), 0)
+        self.assertEqual(store.mark_due(110.0), 4)
+        self.assertCountsMatch(store)
+        self.assertEqual(store.pending_count(), 6)
+        store.close()
+        # The counts are committed along with the urls.
+        store = self.open()
+        self.assertEqual((len(store), store.pending_count()), (10, 6))
+        self.assertCountsMatch(store)
+        store.close()
+
+    def test_migrate_shelve(self):
+        shelve_file = os.path.join(self.dir, "frontier.shelve")
+        with shelve.open(shelve_file) as old:
+            for i, url in enumerate(URLS):
+                old[get_urlhash(url)] = (url, i % 2 == 0)
+        store = self.open()
+        self.assertEqual(migrate_shelve(shelve_file, store), len(URLS))
+        store.db.close()
+        # migrate_shelve commits, so nothing is lost on reopening.
+        store = self.open()
+        for i, url in enumerate(URLS):
+            self.assertEqual(store.get(get_urlhash(url)), (url, i % 2 == 0))
+        self.assertEqual(store.pending_count(), len(URLS) // 2)
+        self.assertCountsMatch(store)
+        self.assertEqual(
+            sorted(url for page in store.pending_pages(2) for url in page),
+            sorted(URLS[1::2]))
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
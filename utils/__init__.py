@@ -3,9 +3,15 @@ import logging
 from hashlib import sha256
 from urllib.parse import urlparse
 
+from utils.canonical import canonicalize
+
 def get_logger(name, filename=None):
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
+    if logger.handlers:
+        # Already set up by an earlier call; more handlers would repeat
+        # every message.
+        return logger
     if not os.path.exists("Logs"):
         os.makedirs("Logs")
     fh = logging.FileHandler(f"Logs/{filename if filename else name}.log")
@@ -23,13 +29,16 @@ def get_logger(name, filename=None):
 
 
 def get_urlhash(url):
-    parsed = urlparse(url)
+    parsed = urlparse(canonicalize(url))
     # everything other than scheme.
     return sha256(
         f"{parsed.netloc}/{parsed.path}/{parsed.params}/"
         f"{parsed.query}/{parsed.fragment}".encode("utf-8")).hexdigest()
 
+def get_urldigest(urlhash):
+    # the first 16 bytes of a url hash, the compact form the frontier's
+    # seen filter keeps.
+    return bytes.fromhex(urlhash[:32])
+
 def normalize(url):
-    if url.endswith("/"):
-        return url.rstrip("/")
-    return url
+    return canonicalize(url)
@@ -0,0 +1,366 @@
+import os
+import json
+import time
+import heapq
+import shutil
+import itertools
+
+from hashlib import blake2b
+from threading import Lock, local
+
+
+class SpaceSaving(object):
+    ''' Approximate heavy hitters in bounded memory (Metwally et al.'s
+    space-saving algorithm). At most capacity words are counted; a new word
+    takes over the slot of the current minimum and inherits its count, so
+    counts can only be overestimated, by at most that minimum. '''
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = dict()
+        # Lazy min-heap of (count, word); stale entries are skipped on pop.
+        self.heap = list()
+
+    def update(self, counts):
+        for word, count in counts.items():
+            if word in self.counts:
+                self.counts[word] += count
+            elif len(self.counts) < self.capacity:
+                self.counts[word] = count
+            else:
+                floor, evicted = self._pop_min()
+                del self.counts[evicted]
+                self.counts[word] = floor + count
+            heapq.heappush(self.heap, (self.counts[word], word))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(count, word) for word, count in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def _pop_min(self):
+        while True:
+            count, word = heapq.heappop(self.heap)
+            if self.counts.get(word) == count:
+                return count, word
+
+    def merge(self, counts):
+        ''' Adds the counts of another SpaceSaving, keeping the capacity
+        largest. '''
+        for word, count in counts.items():
+            self.counts[word] = self.counts.get(word, 0) + count
+        if len(self.counts) > self.capacity:
+            self.counts = dict(self.most_common(self.capacity))
+        self.heap = [(count, word) for word, count in self.counts.items()]
+        heapq.heapify(self.heap)
+
+    def most_common(self, n):
+        return heapq.nlargest(n, self.counts.items(), key=lambda x: x[1])
+
+
+def write_atomic(path, lines):
+    ''' Writes lines to a temporary file and renames it over path, so a
+    reader never sees a half written report. '''
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        file.writelines(lines)
+    os.replace(tmp_path, path)
+
+
+class UniquePages(object):
+    ''' The distinct urls found by the crawl. Only a 16-byte digest of each
+    url stays in memory; the urls go to a journal file when the report is
+    written, and unique_pages.txt is copied from the journal. The journal
+    is started over by the first write of a run, unless resume() picked it
+    up. '''
+    def __init__(self, journal_path="unique_pages.journal"):
+        self.digests = set()
+        # Urls added since the last drain().
+        self.new_urls = list()
+        self.journal_path = journal_path
+        self.journal_started = False
+
+    def __len__(self):
+        return len(self.digests)
+
+    def add(self, url):
+        digest = self._digest(url)
+        if digest not in self.digests:
+            self.digests.add(digest)
+            self.new_urls.append(url)
+
+    def update(self, urls):
+        for url in urls:
+            self.add(url)
+
+    def _digest(self, url):
+        return blake2b(url.encode("utf-8"), digest_size=16).digest()
+
+    def resume(self):
+        ''' Picks up the journal of an earlier run: its urls count as found
+        already, and the next write appends to it. '''
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path) as journal:
+            for line in journal:
+                url = line.rstrip("\n")
+                if url:
+                    self.digests.add(self._digest(url))
+        self.journal_started = True
+
+    def drain(self):
+        ''' Returns the urls added since the last call. '''
+        urls, self.new_urls = self.new_urls, list()
+        return urls
+
+    def write_report(self, new_urls, count, path="unique_pages.txt"):
+        ''' Appends new_urls to the journal and rewrites path from it. '''
+        with open(self.journal_path,
+                  "a" if self.journal_started else "w") as journal:
+            journal.writelines(url + "\n" for url in new_urls)
+        self.journal_started = True
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            with open(self.journal_path) as journal:
+                shutil.copyfileobj(journal, file)
+            file.write("Total Unique Pages: " + str(count))
+        os.replace(tmp_path, path)
+
+
+class Analytics(object):
+    ''' Counters behind the crawl reports. Updates are incremental and the
+    four report files are only rewritten by snapshot(), every
+    snapshot_pages pages or snapshot_interval seconds. When publish is set,
+    snapshots are handed to it as state() instead, e.g. to be merged with
+    the counters of other crawler processes. '''
+    def __init__(self, top_words=50, word_capacity=10000,
+                 snapshot_pages=500, snapshot_interval=60, unique_pages=None):
+        self.unique_pages = (
+            unique_pages if unique_pages is not None else UniquePages())
+        self.longest_page = {"url": "", "word_count": 0}
+        self.common_words = SpaceSaving(word_capacity)
+        self.subdomains = dict()
+        # Pages that were not parsed, or only partly, by reason.
+        self.skipped = dict()
+        self.top_words = top_words
+        self.snapshot_pages = snapshot_pages
+        self.snapshot_interval = snapshot_interval
+        self.pages_since_snapshot = 0
+        self.last_snapshot = time.monotonic()
+        self.publish = None
+
+    def set_schedule(self, snapshot_pages, snapshot_interval):
+        self.snapshot_pages = snapshot_pages
+        self.snapshot_interval = snapshot_interval
+
+    def add_unique_page(self, url):
+        self.unique_pages.add(url)
+
+    def count_words(self, counts):
+        self.common_words.update(counts)
+
+    def count_subdomain(self, subdomain):
+        self.subdomains[subdomain] = self.subdomains.get(subdomain, 0) + 1
+
+    def count_skip(self, reason):
+        self.skipped[reason] = self.skipped.get(reason, 0) + 1
+
+    def update_longest_page(self, url, word_count):
+        if word_count > self.longest_page["word_count"]:
+            self.longest_page["url"] = url
+            self.longest_page["word_count"] = word_count
+
+    def page_done(self):
+        self.pages_since_snapshot += 1
+        if (self.pages_since_snapshot >= self.snapshot_pages
+                or time.monotonic() - self.last_snapshot
+                >= self.snapshot_interval):
+            self.snapshot()
+
+    def snapshot(self):
+        self.pages_since_snapshot = 0
+        self.last_snapshot = time.monotonic()
+        if self.publish:
+            self.publish(self.state())
+        else:
+            self.write_reports()
+
+    def state(self):
+        ''' The counters, with only the unique pages found since the last
+        state(), so that merging states never repeats a url. '''
+        return {
+            "new_pages": self.unique_pages.drain(),
+            "longest_page": self.longest_page,
+            "common_words": self.common_words.counts,
+            "subdomains": self.subdomains,
+            "skipped": self.skipped}
+
+    def dumps(self):
+        ''' The counters, without the unique pages, which are kept in their
+        journal. '''
+        return json.dumps({
+            "longest_page": self.longest_page,
+            "common_words": self.common_words.counts,
+            "subdomains": self.subdomains,
+            "skipped": self.skipped})
+
+    def loads(self, data):
+        ''' Adds counters saved by dumps() to these. '''
+        state = json.loads(data)
+        state["new_pages"] = list()
+        self.merge(state)
+
+    def merge(self, state):
+        ''' Adds the counters of another Analytics' state() to these. '''
+        self.unique_pages.update(state["new_pages"])
+        self.update_longest_page(
+            state["longest_page"]["url"], state["longest_page"]["word_count"])
+        self.common_words.merge(state["common_words"])
+        for subdomain, count in state["subdomains"].items():
+            self.subdomains[subdomain] = self.subdomains.get(subdomain, 0) + count
+        for reason, count in state["skipped"].items():
+            self.skipped[reason] = self.skipped.get(reason, 0) + count
+
+    def write_reports(self):
+        self.unique_pages.write_report(
+            self.unique_pages.drain(), len(self.unique_pages))
+        self.write_counters()
+
+    def write_counters(self):
+        ''' Writes every report but unique_pages.txt. '''
+        write_atomic("longest_page.txt", [
+            "Longest Page: " + self.longest_page["url"] + "\n",
+            "Word Count: " + str(self.longest_page["word_count"])])
+        write_atomic("most_common_words.txt", [
+            word + ": " + str(count) + "\n"
+            for word, count in self.common_words.most_common(self.top_words)])
+        write_atomic("subdomains.txt", [
+            subdomain + ": " + str(count) + "\n"
+            for subdomain, count in sorted(self.subdomains.items())])
+        write_atomic("skipped_pages.txt", [
+            reason + ": " + str(count) + "\n"
+            for reason, count in sorted(self.skipped.items())])
+
+
+class ShardedAnalytics(object):
+    ''' Analytics that many threads can update at once. Every thread counts
+    into its own Analytics shard behind its own lock, which only that thread
+    and the occasional snapshot ever take, and state() merges the shards on
+    read. Unique pages are kept once for all threads, behind a lock held
+    just for the set lookup, so that no url is reported twice. Snapshots are skipped rather than waited for while another thread
+    is taking one, and the report files are written by writer (see
+    utils/crawl_state.py) when one is given. '''
+    def __init__(self, top_words=50, word_capacity=10000,
+                 snapshot_pages=500, snapshot_interval=60, writer=None):
+        self.top_words = top_words
+        self.word_capacity = word_capacity
+        self.snapshot_pages = snapshot_pages
+        self.snapshot_interval = snapshot_interval
+        self.writer = writer
+        self.publish = None
+        self.local = local()
+        self.shards = list()
+        self.shards_lock = Lock()
+        self.unique_pages = UniquePages()
+        self.unique_pages_lock = Lock()
+        self.snapshot_lock = Lock()
+        # next() on a count is atomic, so pages are counted without a lock.
+        self.pages_done = itertools.count(1)
+        self.pages = 0
+        self.pages_at_snapshot = 0
+        self.last_snapshot = time.monotonic()
+
+    def set_schedule(self, snapshot_pages, snapshot_interval):
+        self.snapshot_pages = snapshot_pages
+        self.snapshot_interval = snapshot_interval
+
+    def _shard(self):
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = (Lock(), Analytics(self.top_words, self.word_capacity))
+            with self.shards_lock:
+                self.shards.append(shard)
+            self.local.shard = shard
+        return shard
+
+    def add_unique_page(self, url):
+        with self.unique_pages_lock:
+            self.unique_pages.add(url)
+
+    def count_words(self, counts):
+        lock, shard = self._shard()
+        with lock:
+            shard.count_words(counts)
+
+    def count_subdomain(self, subdomain):
+        lock, shard = self._shard()
+        with lock:
+            shard.count_subdomain(subdomain)
+
+    def count_skip(self, reason):
+        lock, shard = self._shard()
+        with lock:
+            shard.count_skip(reason)
+
+    def update_longest_page(self, url, word_count):
+        lock, shard = self._shard()
+        with lock:
+            shard.update_longest_page(url, word_count)
+
+    def page_done(self):
+        self.pages = pages = next(self.pages_done)
+        if (pages - self.pages_at_snapshot >= self.snapshot_pages
+                or time.monotonic() - self.last_snapshot
+                >= self.snapshot_interval):
+            self.snapshot(blocking=False)
+
+    def snapshot(self, blocking=True):
+        if not self.snapshot_lock.acquire(blocking):
+            return
+        try:
+            self.pages_at_snapshot = self.pages
+            self.last_snapshot = time.monotonic()
+            merged = self.merged()
+            with self.unique_pages_lock:
+                new_pages = self.unique_pages.drain()
+                count = len(self.unique_pages)
+            if self.publish:
+                state = merged.state()
+                state["new_pages"] = new_pages
+                self.publish(state)
+            elif self.writer:
+                self.writer.submit(
+                    self._write_reports, merged, new_pages, count)
+            else:
+                self._write_reports(merged, new_pages, count)
+        finally:
+            self.snapshot_lock.release()
+
+    def merged(self):
+        ''' Returns a new Analytics holding the counters of every shard. '''
+        merged = Analytics(self.top_words, self.word_capacity)
+        with self.shards_lock:
+            shards = list(self.shards)
+        for lock, shard in shards:
+            with lock:
+                merged.merge(shard.state())
+        return merged
+
+    def _write_reports(self, merged, new_pages, count):
+        self.unique_pages.write_report(new_pages, count)
+        merged.write_counters()
+
+    def state(self):
+        state = self.merged().state()
+        with self.unique_pages_lock:
+            state["new_pages"] = self.unique_pages.drain()
+        return state
+
+    def dumps(self):
+        return self.merged().dumps()
+
+    def loads(self, data):
+        ''' Resumes from counters an earlier run saved with dumps(), and
+        from its unique pages journal. '''
+        lock, shard = self._shard()
+        with lock:
+            shard.loads(data)
+        with self.unique_pages_lock:
+            self.unique_pages.resume()
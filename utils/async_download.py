@@ -0,0 +1,97 @@
+import time
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.download import (
+    backoff_delays, download, record_download, to_response, too_large)
+from utils.response import Response
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncDownloader(object):
+    ''' Downloads from the cache server from an asyncio event loop, with at
+    most config.download_concurrency requests in flight over a pool of
+    keep-alive connections. Uses aiohttp when it is installed; otherwise
+    runs utils.download.download, which shares one pooled requests session,
+    on a thread pool of the same size.
+
+        async with AsyncDownloader(config, logger) as downloader:
+            resp = await downloader.download(url)
+    '''
+    def __init__(self, config, logger=None):
+        self.config = config
+        self.logger = logger
+        self.session = None
+        self.executor = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.config.download_concurrency)
+        if aiohttp is not None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.config.download_concurrency),
+                timeout=aiohttp.ClientTimeout(
+                    total=self.config.download_timeout))
+        else:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.config.download_concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self.session is not None:
+            await self.session.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    async def download(self, url):
+        async with self.semaphore:
+            if self.session is None:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self.executor, download, url, self.config, self.logger)
+            start = time.perf_counter()
+            resp = await self._download_aiohttp(url)
+            record_download(resp, time.perf_counter() - start)
+            return resp
+
+    async def _read_capped(self, resp):
+        max_bytes = self.config.max_download_bytes
+        if resp.content_length is not None and resp.content_length > max_bytes:
+            return None
+        chunks = list()
+        size = 0
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+            if size > max_bytes:
+                return None
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    async def _download_aiohttp(self, url):
+        host, port = self.config.cache_server
+        params = [("q", f"{url}"), ("u", f"{self.config.user_agent}")]
+        for delay in backoff_delays(self.config) + [None]:
+            try:
+                async with self.session.get(
+                        f"http://{host}:{port}/", params=params) as resp:
+                    content = await self._read_capped(resp)
+                    if content is None:
+                        return too_large(url, self.config, self.logger)
+                    return to_response(
+                        url, resp.status, content if resp.ok else None,
+                        self.logger)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if delay is None:
+                    if self.logger:
+                        self.logger.error(
+                            f"Could not reach cache server for {url}: {e}")
+                    return Response({
+                        "error": f"Could not reach cache server: {e}",
+                        "status": 600,
+                        "url": url})
+                await asyncio.sleep(delay)
@@ -0,0 +1,73 @@
+import os
+import math
+import struct
+
+MAGIC = b"BLOOM1"
+# magic, bits, hashes, items added, stamp
+HEADER = struct.Struct("<6sQIQQ")
+
+
+class BloomFilter(object):
+    ''' Set of 16-byte digests that can answer "maybe present" wrongly, with
+    probability about error_rate while it holds at most capacity items, but
+    never answers "absent" wrongly. Positions come from the two halves of
+    the digest (double hashing), so nothing is hashed again. '''
+    def __init__(self, capacity=10000000, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, digest):
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:16], "little") | 1
+        for i in range(self.hashes):
+            yield (first + i * step) % self.size
+
+    def add(self, digest):
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, digest):
+        bits = self.bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(digest))
+
+    def __len__(self):
+        return self.count
+
+    def save(self, path, stamp=0):
+        ''' Writes the filter to path, with stamp for load() to check. '''
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(HEADER.pack(
+                MAGIC, self.size, self.hashes, self.count, stamp))
+            file.write(self.bits)
+        os.replace(tmp_path, path)
+
+    def load(self, path, stamp=0):
+        ''' Replaces the contents with the filter saved at path. Returns
+        False, and changes nothing, when there is no such file or it was
+        saved with a different size or stamp. '''
+        try:
+            with open(path, "rb") as file:
+                header = file.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return False
+                magic, size, hashes, count, saved_stamp = HEADER.unpack(header)
+                if (magic != MAGIC or size != self.size
+                        or hashes != self.hashes or saved_stamp != stamp):
+                    return False
+                bits = bytearray(file.read())
+        except FileNotFoundError:
+            return False
+        if len(bits) != len(self.bits):
+            return False
+        self.bits = bits
+        self.count = count
+        return True
@@ -0,0 +1,70 @@
+import re
+
+from fnmatch import translate
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# Session, tracking and comment-reply parameters that never change a page.
+DEFAULT_DROP_PARAMS = ("replytocom", "share", "utm_*")
+DEFAULT_INDEX_PAGES = ("index.html", "index.htm", "index.php")
+
+
+class Canonicalizer(object):
+    ''' Rewrites urls that name the same page to one canonical form:
+    lowercase scheme and host, no default port, no fragment, no trailing
+    slash or index page, no dropped parameters, and query keys sorted.
+    drop_params are shell-style patterns matched against query keys. '''
+    def __init__(self, drop_params=DEFAULT_DROP_PARAMS, sort_query=True,
+                 index_pages=DEFAULT_INDEX_PAGES):
+        self.drop_pattern = (
+            re.compile("|".join(translate(p.lower()) for p in drop_params))
+            if drop_params else None)
+        self.sort_query = sort_query
+        self.index_pages = frozenset(index_pages)
+
+    def _query(self, query):
+        # Works on the raw "key=value" pairs so their escaping is kept.
+        pairs = [pair for pair in query.split("&") if pair]
+        if self.drop_pattern:
+            pairs = [
+                pair for pair in pairs
+                if not self.drop_pattern.match(pair.split("=", 1)[0].lower())]
+        if self.sort_query:
+            pairs.sort(key=lambda pair: pair.split("=", 1)[0])
+        return "&".join(pairs)
+
+    def canonicalize(self, url):
+        try:
+            parts = urlsplit(url.strip())
+            port = parts.port
+        except ValueError:
+            return url
+        scheme = parts.scheme.lower()
+        userinfo, _, _ = parts.netloc.rpartition("@")
+        netloc = parts.hostname or ""
+        if ":" in netloc:
+            netloc = f"[{netloc}]"
+        if port and port != DEFAULT_PORTS.get(scheme):
+            netloc = f"{netloc}:{port}"
+        if userinfo:
+            netloc = f"{userinfo}@{netloc}"
+        path = parts.path
+        head, _, last = path.rpartition("/")
+        if last.lower() in self.index_pages:
+            path = head
+        path = path.rstrip("/")
+        return urlunsplit((scheme, netloc, path, self._query(parts.query), ""))
+
+
+_canonicalizer = Canonicalizer()
+
+
+def configure(drop_params=DEFAULT_DROP_PARAMS, sort_query=True,
+              index_pages=DEFAULT_INDEX_PAGES):
+    ''' Replaces the rules canonicalize() uses. '''
+    global _canonicalizer
+    _canonicalizer = Canonicalizer(drop_params, sort_query, index_pages)
+
+
+def canonicalize(url):
+    return _canonicalizer.canonicalize(url)
@@ -1,6 +1,11 @@
+import os
 import re
 
 
+def _split_list(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
 class Config(object):
     def __init__(self, config):
         self.user_agent = config["IDENTIFICATION"]["USERAGENT"].strip()
@@ -9,11 +14,109 @@ class Config(object):
         assert re.match(r"^[a-zA-Z0-9_ ,]+$", self.user_agent), "User agent should not have any special characters outside '_', ',' and 'space'"
         self.threads_count = int(config["LOCAL PROPERTIES"]["THREADCOUNT"])
         self.save_file = config["LOCAL PROPERTIES"]["SAVE"]
+        # Group commit for the save file: every SAVEBATCH url updates or
+        # every SAVEINTERVAL milliseconds, whichever comes first.
+        self.save_batch = config["LOCAL PROPERTIES"].getint("SAVEBATCH", 500)
+        self.save_interval = config["LOCAL PROPERTIES"].getint(
+            "SAVEINTERVAL", 1000) / 1000
+        # Pending urls are read back from the save file this many at a time.
+        self.pending_page_size = config["LOCAL PROPERTIES"].getint(
+            "PENDINGPAGE", 10000)
+        # In-memory filter of the urls in the save file, sized for
+        # SEENCAPACITY urls with a false "maybe seen" rate of SEENERRORRATE.
+        self.seen_filter_capacity = config["LOCAL PROPERTIES"].getint(
+            "SEENCAPACITY", 10000000)
+        self.seen_filter_error_rate = config["LOCAL PROPERTIES"].getfloat(
+            "SEENERRORRATE", 0.001)
 
         self.host = config["CONNECTION"]["HOST"]
         self.port = int(config["CONNECTION"]["PORT"])
+        # Seconds to wait for the cache server, and how many times to retry
+        # a request that failed to connect or timed out, waiting BACKOFF
+        # seconds before the first retry and twice as long before each next.
+        self.download_timeout = config["CONNECTION"].getfloat("TIMEOUT", 30)
+        self.download_retries = config["CONNECTION"].getint("RETRIES", 2)
+        self.download_backoff = config["CONNECTION"].getfloat("BACKOFF", 1)
+        # Cache server responses larger than this are dropped unread.
+        self.max_download_bytes = config["CONNECTION"].getint(
+            "MAXDOWNLOADBYTES", 10 * 1024 * 1024)
+        # Pipelined crawl: parser processes, fetched pages that may wait for
+        # a parser, and seconds between two stats lines.
+        self.parsers = config["LOCAL PROPERTIES"].getint(
+            "PARSERS", os.cpu_count() or 1)
+        self.pipeline_queue_size = config["LOCAL PROPERTIES"].getint(
+            "PIPELINEQUEUE", 64)
+        self.stats_interval = config["LOCAL PROPERTIES"].getfloat(
+            "STATSINTERVAL", 30)
+        # Metrics (utils/metrics.py): logged and dumped to METRICSFILE every
+        # STATSINTERVAL seconds, served on 127.0.0.1:METRICSPORT unless it
+        # is 0, and PROFILE samples scraper.extract_next_links from the start.
+        self.metrics_file = config["LOCAL PROPERTIES"].get(
+            "METRICSFILE", "metrics.json")
+        self.metrics_port = config["LOCAL PROPERTIES"].getint("METRICSPORT", 0)
+        self.profile = config["LOCAL PROPERTIES"].getboolean("PROFILE", False)
+        # Downloads kept in flight by each async worker.
+        self.download_concurrency = config["LOCAL PROPERTIES"].getint(
+            "CONCURRENCY", 8)
 
         self.seed_urls = config["CRAWLER"]["SEEDURL"].split(",")
         self.time_delay = float(config["CRAWLER"]["POLITENESS"])
+        # Per-host delays: LATENCYFACTOR times the host's response time, at
+        # least POLITENESS and, backed off after failures, at most
+        # MAXPOLITENESS. BLACKLISTAFTER failures in a row blacklist the host
+        # for BLACKLISTSECONDS.
+        self.max_time_delay = config["CRAWLER"].getfloat("MAXPOLITENESS", 60)
+        self.latency_factor = config["CRAWLER"].getfloat("LATENCYFACTOR", 2)
+        self.blacklist_after = config["CRAWLER"].getint("BLACKLISTAFTER", 5)
+        self.blacklist_seconds = config["CRAWLER"].getfloat(
+            "BLACKLISTSECONDS", 600)
+        # Canonicalization rules: query keys to drop (shell-style patterns),
+        # whether to sort query keys, and page names that mean "directory".
+        self.drop_params = _split_list(
+            config["CRAWLER"].get("DROPPARAMS", "replytocom,share,utm_*"))
+        self.sort_query = config["CRAWLER"].getboolean("SORTQUERY", True)
+        self.index_pages = _split_list(config["CRAWLER"].get(
+            "INDEXPAGES", "index.html,index.htm,index.php"))
+        # Trap detection at frontier admission: most urls admitted per url
+        # template (digits replaced by #), per host, and distinct queries
+        # per path.
+        self.trap_template_budget = config["CRAWLER"].getint(
+            "TRAPTEMPLATEBUDGET", 500)
+        self.trap_host_budget = config["CRAWLER"].getint(
+            "TRAPHOSTBUDGET", 50000)
+        self.trap_query_budget = config["CRAWLER"].getint(
+            "TRAPQUERYBUDGET", 100)
+        # Once REDIRECTRULEMIN pages of an origin redirected to the same
+        # path on one other origin, new urls of the origin are rewritten.
+        self.redirect_rule_min = config["CRAWLER"].getint(
+            "REDIRECTRULEMIN", 3)
+        # Only the first MAXPAGEBYTES bytes of a page are parsed.
+        self.max_page_bytes = config["CRAWLER"].getint(
+            "MAXPAGEBYTES", 1024 * 1024)
+        # A page whose SimHash is within NEARDUPDISTANCE bits of one of the
+        # last NEARDUPFINGERPRINTS pages is a near-duplicate.
+        self.near_duplicate_distance = config["CRAWLER"].getint(
+            "NEARDUPDISTANCE", 3)
+        self.near_duplicate_fingerprints = config["CRAWLER"].getint(
+            "NEARDUPFINGERPRINTS", 1000000)
+        # The report files are rewritten every SNAPSHOTPAGES pages or every
+        # SNAPSHOTINTERVAL seconds, and once more when the crawler stops.
+        self.snapshot_pages = config["CRAWLER"].getint("SNAPSHOTPAGES", 500)
+        self.snapshot_interval = config["CRAWLER"].getfloat(
+            "SNAPSHOTINTERVAL", 60)
+        # Binary log of the tokens of every parsed page (utils/tokenlog.py),
+        # with each page compressed by TOKENLOGCOMPRESSION: none, zlib or lzma.
+        self.token_log = config["CRAWLER"].get("TOKENLOG", "tokens.log")
+        self.token_log_compression = config["CRAWLER"].get(
+            "TOKENLOGCOMPRESSION", "none")
+        # A page is revisited RECRAWLMIN seconds after it was downloaded,
+        # twice as late every time it had not changed, up to RECRAWLMAX.
+        self.recrawl_min_interval = config["CRAWLER"].getfloat(
+            "RECRAWLMIN", 86400)
+        self.recrawl_max_interval = config["CRAWLER"].getfloat(
+            "RECRAWLMAX", 30 * 86400)
 
-        self.cache_server = None
\ No newline at end of file
+        self.cache_server = None
+        # Set by launch.py --recrawl: re-queue the downloaded pages that
+        # are due for a revisit.
+        self.recrawl = False
\ No newline at end of file
@@ -0,0 +1,111 @@
+from queue import Queue
+from threading import Thread, Lock
+
+from utils.analytics import ShardedAnalytics
+from utils.simhash import NearDuplicateIndex
+from utils.tokenlog import TokenLogWriter
+
+
+class Writer(object):
+    ''' One thread that does all of the crawl's file output. Other threads
+    submit(function, *args) and go on; jobs run in order on the writer
+    thread, so no two of them ever write at the same time. The queue is
+    bounded, so submitters block instead of piling up unwritten pages. The
+    thread starts with the first job and stops in close(). '''
+    def __init__(self, max_jobs=10000):
+        self.jobs = Queue(maxsize=max_jobs)
+        self.lock = Lock()
+        self.thread = None
+
+    def submit(self, function, *args):
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(
+                    target=self._run, name="Writer", daemon=True)
+                self.thread.start()
+        self.jobs.put((function, args))
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            function, args = job
+            try:
+                function(*args)
+            except Exception as e:
+                print("An error occurred while writing: ", e)
+
+    def close(self):
+        ''' Runs the submitted jobs and stops the thread. '''
+        with self.lock:
+            if self.thread is not None:
+                self.jobs.put(None)
+                self.thread.join()
+                self.thread = None
+
+
+class CrawlState(object):
+    ''' Everything the scraper updates while crawling, shared by every
+    worker thread without one lock around the whole page:
+
+    - analytics counts into a shard per thread (ShardedAnalytics);
+    - the near-duplicate index is the only check-and-add that needs the
+      other threads' pages, so it gets its own short lock;
+    - the token log and the report files are written by the writer
+      thread. '''
+    def __init__(self, max_page_bytes=1024 * 1024, token_log_path="tokens.log",
+                 token_log_compression="none"):
+        self.writer = Writer()
+        self.analytics = ShardedAnalytics(writer=self.writer)
+        self.near_duplicates = NearDuplicateIndex()
+        self.near_duplicates_lock = Lock()
+        # Called with the url of every near-duplicate page.
+        self.near_duplicate_listeners = list()
+        # Called with the url and the final url of every page that was
+        # redirected.
+        self.redirect_listeners = list()
+        self.max_page_bytes = max_page_bytes
+        self.set_token_log(token_log_path, token_log_compression)
+        # Only the writer thread touches the token log.
+        self.token_log = None
+
+    def is_near_duplicate(self, fingerprint):
+        ''' Indexes fingerprint and tells whether a near one was already
+        seen. '''
+        with self.near_duplicates_lock:
+            return self.near_duplicates.seen(fingerprint)
+
+    def set_near_duplicates(self, max_distance=3, max_fingerprints=1000000):
+        ''' Starts a new near-duplicate index: pages within max_distance
+        bits of one of the last max_fingerprints pages are near-duplicates.
+        '''
+        with self.near_duplicates_lock:
+            self.near_duplicates = NearDuplicateIndex(
+                max_distance, max_fingerprints)
+
+    def set_token_log(self, path, compression="none"):
+        ''' Where the tokens of the pages go, see utils/tokenlog.py. Takes
+        effect when the log is next opened. '''
+        self.token_log_path = path
+        self.token_log_compression = compression
+
+    def log_tokens(self, url, tokens):
+        self.writer.submit(self._write_tokens, url, tokens)
+
+    def _write_tokens(self, url, tokens):
+        if self.token_log is None:
+            self.token_log = TokenLogWriter(
+                self.token_log_path, self.token_log_compression)
+        self.token_log.write(url, tokens)
+
+    def _close_tokens(self):
+        if self.token_log is not None:
+            self.token_log.close()
+            self.token_log = None
+
+    def close(self):
+        ''' Takes a last snapshot and waits for all output to be written. '''
+        self.analytics.snapshot()
+        self.writer.submit(self._close_tokens)
+        self.writer.close()
@@ -2,20 +2,126 @@ import requests
 import cbor
 import time
 
+from threading import Lock
+from requests.adapters import HTTPAdapter
+
 from utils.response import Response
+from utils import metrics
 
-def download(url, config, logger=None):
-    host, port = config.cache_server
-    resp = requests.get(
-        f"http://{host}:{port}/",
-        params=[("q", f"{url}"), ("u", f"{config.user_agent}")])
+_session = None
+_session_lock = Lock()
+
+download_seconds = metrics.histogram(
+    "download_seconds", "Time to get a page from the cache server, retries "
+    "included.")
+download_responses = metrics.counter(
+    "download_responses_total", "Responses from the cache server.", "status")
+
+
+def record_download(resp, seconds):
+    download_seconds.observe(seconds)
+    download_responses.inc(label_value=str(resp.status))
+
+
+def get_session(config):
+    ''' One keep-alive session shared by every worker thread, so downloads
+    reuse pooled connections to the cache server instead of opening a new
+    TCP connection per url. '''
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=max(config.threads_count,
+                                 config.download_concurrency))
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def backoff_delays(config):
+    ''' Seconds to wait before each retry of a failed request. '''
+    return [config.download_backoff * 2 ** attempt
+            for attempt in range(config.download_retries)]
+
+
+def too_large(url, config, logger=None):
+    # 413 Payload Too Large: the body was dropped without being read.
+    if logger:
+        logger.error(
+            f"Response for {url} is larger than "
+            f"{config.max_download_bytes} bytes, skipped.")
+    return Response({
+        "error": f"Response is larger than {config.max_download_bytes} bytes.",
+        "status": 413,
+        "url": url})
+
+
+def read_capped(resp, max_bytes):
+    ''' Reads the body of a streamed response, or returns None as soon as
+    it is known to be larger than max_bytes. '''
+    length = resp.headers.get("Content-Length", "")
+    if length.isdigit() and int(length) > max_bytes:
+        resp.close()
+        return None
+    chunks = list()
+    size = 0
+    for chunk in resp.iter_content(64 * 1024):
+        size += len(chunk)
+        if size > max_bytes:
+            resp.close()
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def to_response(url, status_code, content, logger=None):
     try:
-        if resp and resp.content:
-            return Response(cbor.loads(resp.content))
-    except (EOFError, ValueError) as e:
+        if content:
+            return Response(cbor.loads(content))
+    except (EOFError, ValueError, LookupError, TypeError):
+        # Not cbor, or cbor that is not a cache server response.
         pass
-    logger.error(f"Spacetime Response error {resp} with url {url}.")
+    if logger:
+        logger.error(f"Spacetime Response error {status_code} with url {url}.")
     return Response({
-        "error": f"Spacetime Response error {resp} with url {url}.",
-        "status": resp.status_code,
+        "error": f"Spacetime Response error {status_code} with url {url}.",
+        "status": status_code,
         "url": url})
+
+
+def download(url, config, logger=None):
+    start = time.perf_counter()
+    resp = _download(url, config, logger)
+    record_download(resp, time.perf_counter() - start)
+    return resp
+
+
+def _download(url, config, logger):
+    host, port = config.cache_server
+    session = get_session(config)
+    for delay in backoff_delays(config) + [None]:
+        try:
+            resp = session.get(
+                f"http://{host}:{port}/",
+                params=[("q", f"{url}"), ("u", f"{config.user_agent}")],
+                timeout=config.download_timeout, stream=True)
+            # Stop reading as soon as the body is known to be too large.
+            content = read_capped(resp, config.max_download_bytes)
+            break
+        except requests.RequestException as e:
+            # Connection errors and timeouts, but also a body cut short
+            # (ChunkedEncodingError) or that does not decode, which stream=True
+            # only raises while read_capped reads it.
+            if delay is None:
+                if logger:
+                    logger.error(f"Could not reach cache server for {url}: {e}")
+                return Response({
+                    "error": f"Could not reach cache server: {e}",
+                    "status": 600,
+                    "url": url})
+            time.sleep(delay)
+    if content is None:
+        return too_large(url, config, logger)
+    return to_response(url, resp.status_code, content if resp else None, logger)
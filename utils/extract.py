@@ -0,0 +1,169 @@
+import re
+import codecs
+
+from html.parser import HTMLParser
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# Tags whose text counts as the "good content" of a page.
+CONTENT_TAGS = frozenset([
+    "title", "p", "h1", "h2", "h3", "ul", "ol", "li", "table", "tr", "td"])
+# Navigation boilerplate; nothing inside these is content.
+BOILERPLATE_TAGS = frozenset(["nav", "header", "footer"])
+# Never text, even inside a content tag.
+IGNORED_TAGS = frozenset(["script", "style", "noscript", "template"])
+VOID_TAGS = frozenset([
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link",
+    "meta", "param", "source", "track", "wbr"])
+# <meta charset="..."> or <meta http-equiv="Content-Type" content="...;
+# charset=...">, looked for at the top of the page.
+META_CHARSET = re.compile(
+    rb"<meta[^>]+charset\s*=\s*[\"']?\s*([\w.:-]+)", re.IGNORECASE)
+META_CHARSET_BYTES = 2048
+
+
+class Page(object):
+    def __init__(self, text, links, tokens):
+        self.text = text
+        self.links = links
+        self.tokens = tokens
+
+
+class _Collector(object):
+    ''' Parser target shared by the lxml and html.parser backends. Keeps
+    depth counters instead of walking parents, so every tag costs O(1). '''
+    def __init__(self):
+        self.content_depth = 0
+        self.boilerplate_depth = 0
+        self.ignored_depth = 0
+        self.chunks = []
+        self.links = []
+
+    def start(self, tag, attrib):
+        if tag == "a":
+            href = attrib.get("href")
+            if href is not None:
+                self.links.append(href)
+        if tag in CONTENT_TAGS:
+            self.content_depth += 1
+            # Separate the text of neighbouring content tags.
+            self.chunks.append(" ")
+        elif tag in BOILERPLATE_TAGS:
+            self.boilerplate_depth += 1
+        elif tag in IGNORED_TAGS:
+            self.ignored_depth += 1
+
+    def end(self, tag):
+        if tag in CONTENT_TAGS:
+            self.content_depth = max(self.content_depth - 1, 0)
+            self.chunks.append(" ")
+        elif tag in BOILERPLATE_TAGS:
+            self.boilerplate_depth = max(self.boilerplate_depth - 1, 0)
+        elif tag in IGNORED_TAGS:
+            self.ignored_depth = max(self.ignored_depth - 1, 0)
+
+    def data(self, data):
+        if (self.content_depth and not self.boilerplate_depth
+                and not self.ignored_depth):
+            self.chunks.append(data)
+
+    def close(self):
+        return self
+
+
+class _StreamParser(HTMLParser):
+    ''' html.parser front end. Unlike lxml it does not balance tags, so it
+    keeps a stack of open tags and closes anything left open by an end tag
+    further up. '''
+    def __init__(self, collector):
+        super().__init__(convert_charrefs=True)
+        self.collector = collector
+        self.open_tags = []
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag, dict(attrs))
+        if tag in VOID_TAGS:
+            self.collector.end(tag)
+        else:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.collector.start(tag, dict(attrs))
+        self.collector.end(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in self.open_tags:
+            return
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.collector.end(open_tag)
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+    def close(self):
+        super().close()
+        while self.open_tags:
+            self.collector.end(self.open_tags.pop())
+
+
+def _known_encoding(encoding):
+    if not encoding:
+        return None
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        return None
+
+
+def decode(content, encoding=None):
+    ''' The text of content. Bytes are decoded with encoding, the charset
+    of the Content-Type header, else with the charset of a <meta> tag at
+    the top of the page, else as UTF-8; a byte order mark overrides both.
+    Bytes that do not decode are replaced. '''
+    if isinstance(content, str):
+        return content
+    if content.startswith(codecs.BOM_UTF8):
+        return content[len(codecs.BOM_UTF8):].decode("utf-8", errors="replace")
+    encoding = _known_encoding(encoding)
+    if encoding is None:
+        match = META_CHARSET.search(content, 0, META_CHARSET_BYTES)
+        if match is not None:
+            encoding = _known_encoding(match.group(1).decode("ascii"))
+    return content.decode(encoding or "utf-8", errors="replace")
+
+
+def _parse_lxml(content, collector):
+    # Given text, since lxml would take bytes without a <meta> charset for
+    # Latin-1.
+    parser = etree.HTMLParser(target=collector)
+    parser.feed(content)
+    parser.close()
+
+
+def _parse_stdlib(content, collector):
+    parser = _StreamParser(collector)
+    parser.feed(content)
+    parser.close()
+
+
+def extract(content, tokenize, encoding=None):
+    ''' Walks the document once and returns a Page with the content text,
+    the raw href of every link, and the tokens of the text. Uses lxml when
+    it is installed and html.parser otherwise. encoding is the charset the
+    server sent for content, if any; see decode(). '''
+    collector = _Collector()
+    if not content:
+        return Page("", [], [])
+    content = decode(content, encoding)
+    if etree is not None:
+        _parse_lxml(content, collector)
+    else:
+        _parse_stdlib(content, collector)
+    text = "".join(collector.chunks)
+    return Page(text, collector.links, tokenize(text))
@@ -0,0 +1,396 @@
+''' Crawl metrics: counters, histograms and callbacks read on demand, kept in
+one registry per process.
+
+    from utils import metrics
+    metrics.counter("pages_total", "Pages crawled.").inc()
+    with metrics.histogram("parse_seconds", "Time to parse a page.").time():
+        ...
+    metrics.callback("frontier_queued_urls", "Urls queued.", lambda: n)
+
+MetricsService reports the registry as a log line and a JSON file every
+STATSINTERVAL seconds and, when METRICSPORT is set, serves it on
+http://127.0.0.1:METRICSPORT/metrics in the Prometheus text format.
+SamplingProfiler samples the stacks of threads inside one function, e.g.
+scraper.extract_next_links, and can be started and stopped at runtime. '''
+import sys
+import json
+import time
+import bisect
+import importlib
+import functools
+
+from collections import Counter as Tally
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock, Event, get_ident
+from urllib.parse import urlsplit, parse_qs
+
+from utils.analytics import write_atomic
+
+# Upper bounds in seconds, or counts for histograms of sizes.
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class Counter(object):
+    ''' A count that only goes up, optionally one per label value. '''
+    kind = "counter"
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.lock = Lock()
+        self.counts = dict()
+
+    def inc(self, amount=1, label_value=None):
+        with self.lock:
+            self.counts[label_value] = self.counts.get(label_value, 0) + amount
+
+    def values(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+class Histogram(object):
+    ''' Observations counted into cumulative buckets, with their sum. '''
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = None
+        self.buckets = tuple(buckets)
+        self.lock = Lock()
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def quantile(self, q):
+        ''' The upper bound of the bucket holding the q-quantile. '''
+        with self.lock:
+            target = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets, self.bucket_counts):
+                seen += count
+                if seen >= target and self.count:
+                    return bound
+        return float("inf") if self.count else 0.0
+
+    def values(self):
+        with self.lock:
+            return {
+                "buckets": dict(zip(
+                    [*map(str, self.buckets), "+Inf"], self.bucket_counts)),
+                "count": self.count, "sum": self.sum}
+
+
+class Callback(object):
+    ''' A value read from function whenever the metrics are collected: a
+    number, or a dict from label value to number. '''
+    def __init__(self, name, help, function, kind="gauge", label=None):
+        self.name = name
+        self.help = help
+        self.function = function
+        self.kind = kind
+        self.label = label
+
+    def values(self):
+        value = self.function()
+        return dict(value) if isinstance(value, dict) else {None: value}
+
+
+class Registry(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.metrics = dict()
+
+    def _get(self, name, create):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = create()
+            return metric
+
+    def counter(self, name, help, label=None):
+        return self._get(name, lambda: Counter(name, help, label))
+
+    def histogram(self, name, help, buckets=TIME_BUCKETS):
+        return self._get(name, lambda: Histogram(name, help, buckets))
+
+    def callback(self, name, help, function, kind="gauge", label=None):
+        ''' Registers function under name, replacing any earlier one. '''
+        with self.lock:
+            self.metrics[name] = Callback(name, help, function, kind, label)
+
+    def remove(self, name):
+        with self.lock:
+            self.metrics.pop(name, None)
+
+    def collect(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        collected = dict()
+        for metric in metrics:
+            try:
+                collected[metric.name] = (metric, metric.values())
+            except Exception as e:
+                print(f"Could not read metric {metric.name}: {e}")
+        return collected
+
+    def to_json(self):
+        return {
+            name: {"type": metric.kind, "help": metric.help,
+                   "label": metric.label,
+                   "values": values if metric.kind == "histogram" else {
+                       str(label_value): value
+                       for label_value, value in values.items()}}
+            for name, (metric, values) in self.collect().items()}
+
+    def render(self):
+        ''' The metrics in the Prometheus text exposition format. '''
+        lines = list()
+        for name, (metric, values) in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            if metric.kind == "histogram":
+                cumulative = 0
+                for bound, count in values["buckets"].items():
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum {values['sum']}")
+                lines.append(f"{name}_count {values['count']}")
+                continue
+            for label_value, value in sorted(
+                    values.items(), key=lambda item: str(item[0])):
+                if label_value is None:
+                    lines.append(f"{name} {value}")
+                else:
+                    escaped = str(label_value).replace("\\", "\\\\").replace(
+                        '"', '\\"')
+                    lines.append(
+                        f'{name}{{{metric.label}="{escaped}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        ''' One line with every metric: totals of counters, count, mean and
+        95th percentile of histograms, and the total and largest value of
+        gauges with labels. '''
+        parts = list()
+        for name, (metric, values) in sorted(self.collect().items()):
+            if metric.kind == "histogram":
+                count = values["count"]
+                mean = values["sum"] / count if count else 0
+                parts.append(
+                    f"{name} n={count} mean={mean:.4g} "
+                    f"p95<={metric.quantile(0.95):g}")
+            elif metric.label and metric.kind == "gauge":
+                parts.append(
+                    f"{name} total={sum(values.values())} "
+                    f"max={max(values.values(), default=0)}")
+            else:
+                parts.append(f"{name} {sum(values.values())}")
+        return " | ".join(parts)
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+callback = REGISTRY.callback
+remove = REGISTRY.remove
+
+
+class SamplingProfiler(object):
+    ''' Samples, every interval seconds, the stacks of the threads that are
+    inside target ("module.function"). While it runs, target is replaced by
+    a wrapper that marks the calling thread; calls made through the module
+    attribute are profiled, and stop() puts the function back. Stacks are
+    counted in the folded format flame graph tools read. '''
+    def __init__(self, target="scraper.extract_next_links", interval=0.005):
+        module_name, _, self.function_name = target.rpartition(".")
+        self.module = importlib.import_module(module_name)
+        self.target = target
+        self.interval = interval
+        self.stacks = Tally()
+        self.active = dict()
+        self.stopped = Event()
+        self.thread = None
+        self.function = None
+
+    def start(self):
+        function = self.function = getattr(self.module, self.function_name)
+        active = self.active
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            # Samples of this thread stop at this frame.
+            thread = get_ident()
+            active[thread] = sys._getframe().f_code
+            try:
+                return function(*args, **kwargs)
+            finally:
+                active.pop(thread, None)
+
+        setattr(self.module, self.function_name, wrapper)
+        self.thread = Thread(target=self._sample, daemon=True,
+                             name="SamplingProfiler")
+        self.thread.start()
+        return self
+
+    def _sample(self):
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for thread, root in list(self.active.items()):
+                frame = frames.get(thread)
+                stack = list()
+                while frame is not None and frame.f_code is not root:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:"
+                                 f"{code.co_firstlineno})")
+                    frame = frame.f_back
+                if frame is not None:
+                    stack.append(self.target)
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        ''' Stops sampling and returns the folded stacks. '''
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        setattr(self.module, self.function_name, self.function)
+        return self.folded()
+
+    def folded(self):
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class MetricsService(object):
+    ''' Logs REGISTRY.summary() and writes REGISTRY.to_json() to json_file
+    every interval seconds, and serves the metrics on 127.0.0.1:port unless
+    port is 0:
+
+        /metrics          Prometheus text format
+        /metrics.json     the JSON dump
+        /profile/start    starts a SamplingProfiler (?target=&interval=)
+        /profile/stop     stops it and returns the folded stacks
+
+    When profile is set, the profiler runs from start() to stop(), and the
+    folded stacks are written to profile_file. '''
+    def __init__(self, logger, interval=30, json_file="metrics.json", port=0,
+                 profile=False, profile_file="profile.folded"):
+        self.logger = logger
+        self.interval = interval
+        self.json_file = json_file
+        self.port = port
+        self.profile = profile
+        self.profile_file = profile_file
+        self.profiler = None
+        self.profiler_lock = Lock()
+        self.stopped = Event()
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self._run, daemon=True, name="Metrics")
+        self.thread.start()
+        if self.port:
+            self.server = ThreadingHTTPServer(
+                ("127.0.0.1", self.port), _handler(self))
+            Thread(target=self.server.serve_forever, daemon=True,
+                   name="MetricsServer").start()
+            self.logger.info(
+                f"Serving metrics on http://127.0.0.1:{self.port}/metrics")
+        if self.profile:
+            self.start_profiler()
+        return self
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def report(self):
+        self.logger.info(REGISTRY.summary())
+        write_atomic(self.json_file, [json.dumps(REGISTRY.to_json())])
+
+    def start_profiler(self, target="scraper.extract_next_links",
+                       interval=0.005):
+        with self.profiler_lock:
+            if self.profiler is None:
+                self.profiler = SamplingProfiler(target, interval).start()
+                self.logger.info(f"Profiling {target}.")
+
+    def stop_profiler(self):
+        with self.profiler_lock:
+            if self.profiler is None:
+                return ""
+            profiler, self.profiler = self.profiler, None
+        folded = profiler.stop()
+        write_atomic(self.profile_file, [folded])
+        self.logger.info(f"Wrote the profile of {profiler.target} to "
+                         f"{self.profile_file}.")
+        return folded
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.stop_profiler()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.report()
+
+
+def _handler(service):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = {key: values[-1]
+                     for key, values in parse_qs(url.query).items()}
+            try:
+                if url.path == "/metrics":
+                    body, content_type = REGISTRY.render(), "text/plain"
+                elif url.path == "/metrics.json":
+                    body = json.dumps(REGISTRY.to_json())
+                    content_type = "application/json"
+                elif url.path == "/profile/start":
+                    service.start_profiler(
+                        query.get("target", "scraper.extract_next_links"),
+                        float(query.get("interval", 0.005)))
+                    body, content_type = "profiling\n", "text/plain"
+                elif url.path == "/profile/stop":
+                    body, content_type = service.stop_profiler(), "text/plain"
+                else:
+                    self.send_error(404)
+                    return
+            except Exception as e:
+                self.send_error(500, str(e))
+                return
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsHandler
@@ -10,5 +10,28 @@ class Response(object):
                 pickle.loads(resp_dict["response"])
                 if "response" in resp_dict else
                 None)
-        except TypeError:
+        except (TypeError, EOFError, ValueError, AttributeError, ImportError,
+                pickle.UnpicklingError):
+            # Not a pickled response, or one whose classes cannot be imported.
             self.raw_response = None
+
+    @property
+    def content_type(self):
+        ''' Media type of the page, e.g. "text/html", or "" if unknown. '''
+        headers = getattr(self.raw_response, "headers", None)
+        if not headers:
+            return ""
+        return headers.get("Content-Type", "").split(";")[0].strip().lower()
+
+    @property
+    def charset(self):
+        ''' Charset of the Content-Type header, e.g. "utf-8", or "" if it
+        has none. '''
+        headers = getattr(self.raw_response, "headers", None)
+        if not headers:
+            return ""
+        for parameter in headers.get("Content-Type", "").split(";")[1:]:
+            name, _, value = parameter.partition("=")
+            if name.strip().lower() == "charset":
+                return value.strip().strip("\"'").lower()
+        return ""
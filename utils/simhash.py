@@ -0,0 +1,86 @@
+from collections import Counter, deque
+from hashlib import blake2b
+
+FINGERPRINT_BITS = 64
+
+
+def simhash(tokens, n=3):
+    ''' 64-bit SimHash of the token n-grams of a page, or None for a page
+    without tokens. Pages that share most of their n-grams get fingerprints
+    that differ in only a few bits. '''
+    shingles = {" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)}
+    if not shingles:
+        shingles = set(tokens)
+    if not shingles:
+        return None
+    digests = b"".join(
+        blake2b(shingle.encode("utf-8"), digest_size=8).digest()
+        for shingle in shingles)
+    # Majority vote per bit. Counting each byte column with Counter keeps
+    # the per-shingle work in C instead of a Python loop over 64 bits.
+    half = len(shingles) / 2
+    fingerprint = 0
+    for byte in range(8):
+        column = Counter(digests[byte::8])
+        for bit in range(8):
+            ones = sum(
+                count for value, count in column.items() if value >> bit & 1)
+            if ones > half:
+                fingerprint |= 1 << (byte * 8 + bit)
+    return fingerprint
+
+
+class NearDuplicateIndex(object):
+    ''' Remembers SimHash fingerprints and finds any earlier fingerprint
+    within max_distance bits. The fingerprint is split into max_distance + 1
+    bands; two fingerprints that close must agree on at least one band, so
+    only the fingerprints sharing a band bucket are compared. Keeps at most
+    max_fingerprints fingerprints, forgetting the oldest first. '''
+    def __init__(self, max_distance=3, max_fingerprints=1000000):
+        self.max_distance = max_distance
+        self.max_fingerprints = max_fingerprints
+        self.bands = max_distance + 1
+        self.band_bits = FINGERPRINT_BITS // self.bands
+        self.band_mask = (1 << self.band_bits) - 1
+        self.tables = [dict() for _ in range(self.bands)]
+        self.fingerprints = deque()
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def _band_keys(self, fingerprint):
+        for band in range(self.bands):
+            yield (fingerprint >> (band * self.band_bits)) & self.band_mask
+
+    def find(self, fingerprint):
+        ''' Returns an indexed fingerprint near fingerprint, or None. '''
+        for table, key in zip(self.tables, self._band_keys(fingerprint)):
+            for candidate in table.get(key, ()):
+                if bin(candidate ^ fingerprint).count("1") <= self.max_distance:
+                    return candidate
+        return None
+
+    def add(self, fingerprint):
+        for table, key in zip(self.tables, self._band_keys(fingerprint)):
+            table.setdefault(key, set()).add(fingerprint)
+        self.fingerprints.append(fingerprint)
+        while len(self.fingerprints) > self.max_fingerprints:
+            self._remove(self.fingerprints.popleft())
+
+    def _remove(self, fingerprint):
+        for table, key in zip(self.tables, self._band_keys(fingerprint)):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(fingerprint)
+                if not bucket:
+                    del table[key]
+
+    def seen(self, fingerprint):
+        ''' True if a near-identical fingerprint was indexed before;
+        otherwise indexes fingerprint and returns False. '''
+        if fingerprint is None:
+            return False
+        if self.find(fingerprint) is not None:
+            return True
+        self.add(fingerprint)
+        return False
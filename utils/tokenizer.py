@@ -0,0 +1,155 @@
+''' Tokenizer that turns words into ids of an interned vocabulary, so that
+stop words are dropped with one lookup in a mask and pages are counted as
+integers.
+
+    tokenizer = Tokenizer(stop_words)
+    word_counts = tokenizer.count_words(tokenizer.tokenize(text))
+    ids = tokenizer.encode(tokenizer.tokenize(text))
+    word_counts = tokenizer.count(ids)
+    batch = tokenizer.encode_batch(texts)
+    per_page = tokenizer.count_batch(batch)
+    overall = tokenizer.total(batch)
+
+Tokens are those of scraper.tokenize. The batch methods count with NumPy
+when it is installed and with collections.Counter otherwise; the results
+are the same.
+
+The vocabulary keeps every word it was given and is never trimmed, so a
+crawl, which meets new words (numbers, ids, typos) on every page, counts
+with count_words, which interns nothing. Encode with a Tokenizer that lives
+as long as one batch or one bounded corpus. '''
+from array import array
+from collections import Counter
+from threading import Lock
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Abbreviations keep their periods and contractions their apostrophes, but
+# periods at the end of sentences are dropped.
+TOKEN_PATTERN = re.compile(r"(?:\w+\.\w+|\w+['’]\w+|\w+)")
+
+
+class Vocabulary(object):
+    ''' Words interned as consecutive ids: ids maps a word to its id, words
+    an id to its word, and stop[id] is 1 for stop words. Looking words up
+    needs no lock; new words are added under one, and published in ids only
+    once words and stop have their entry. '''
+    def __init__(self, stop_words=()):
+        self.ids = dict()
+        self.words = list()
+        self.stop = bytearray()
+        self.lock = Lock()
+        for word in stop_words:
+            self.stop[self.intern(word.lower())] = 1
+
+    def intern(self, word):
+        word_id = self.ids.get(word)
+        if word_id is None:
+            with self.lock:
+                word_id = self.ids.get(word)
+                if word_id is None:
+                    word_id = len(self.words)
+                    self.words.append(word)
+                    self.stop.append(0)
+                    self.ids[word] = word_id
+        return word_id
+
+    def __len__(self):
+        return len(self.words)
+
+    def stop_mask(self):
+        ''' The stop word mask as a NumPy boolean array. '''
+        return numpy.frombuffer(bytes(self.stop), dtype=numpy.uint8) != 0
+
+
+class Tokenizer(object):
+    ''' Tokenizes text and counts tokens through one Vocabulary. Safe to
+    share between threads; every process has a vocabulary of its own, so
+    ids never leave the process - count() and friends return words. '''
+    def __init__(self, stop_words=()):
+        self.stop_words = frozenset(word.lower() for word in stop_words)
+        self.vocabulary = Vocabulary(self.stop_words)
+
+    def tokenize(self, text):
+        return TOKEN_PATTERN.findall(text.lower())
+
+    def count_words(self, tokens):
+        ''' Counter of tokens without stop words, without the vocabulary.
+        Counts every token first, so stop words are removed once per page
+        rather than looked up once per token. '''
+        counts = Counter(tokens)
+        for word in self.stop_words.intersection(counts):
+            del counts[word]
+        return counts
+
+    def encode(self, tokens):
+        ''' The ids of tokens, interning the new ones. '''
+        ids = list(map(self.vocabulary.ids.get, tokens))
+        if None in ids:
+            intern = self.vocabulary.intern
+            ids = [
+                word_id if word_id is not None else intern(token)
+                for token, word_id in zip(tokens, ids)]
+        return array("I", ids)
+
+    def count(self, ids):
+        ''' Counter of the words of ids, without stop words. Counts the ids
+        first, so the mask and the vocabulary are only read once per
+        distinct word. '''
+        words = self.vocabulary.words
+        stop = self.vocabulary.stop
+        return Counter({
+            words[word_id]: count for word_id, count in Counter(ids).items()
+            if not stop[word_id]})
+
+    def encode_batch(self, texts):
+        return [self.encode(self.tokenize(text)) for text in texts]
+
+    def count_batch(self, batch):
+        ''' count() of every id array in batch. With NumPy, the (page, id)
+        pairs of the whole batch are counted in one numpy.unique. '''
+        if numpy is None or not batch:
+            return [self.count(ids) for ids in batch]
+        ids = numpy.concatenate(
+            [numpy.frombuffer(ids, dtype=numpy.uint32) for ids in batch])
+        pages = numpy.repeat(
+            numpy.arange(len(batch), dtype=numpy.uint64),
+            [len(ids) for ids in batch])
+        keep = ~self.vocabulary.stop_mask()[ids]
+        keys, counts = numpy.unique(
+            pages[keep] << numpy.uint64(32) | ids[keep].astype(numpy.uint64),
+            return_counts=True)
+        words = self.vocabulary.words
+        results = [Counter() for _ in batch]
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            results[key >> 32][words[key & 0xffffffff]] = count
+        return results
+
+    def total(self, batch):
+        ''' One Counter of the words of every id array in batch, without
+        stop words. With NumPy, a single bincount over the vocabulary. '''
+        if numpy is None:
+            totals = Counter()
+            for ids in batch:
+                totals.update(ids)
+            stop = self.vocabulary.stop
+            words = self.vocabulary.words
+            return Counter({
+                words[word_id]: count for word_id, count in totals.items()
+                if not stop[word_id]})
+        if not batch:
+            return Counter()
+        stop = self.vocabulary.stop_mask()
+        counts = numpy.bincount(numpy.concatenate(
+            [numpy.frombuffer(ids, dtype=numpy.uint32) for ids in batch]),
+            minlength=len(stop))
+        counts[stop] = 0
+        words = self.vocabulary.words
+        return Counter({
+            words[word_id]: count
+            for word_id, count in zip(numpy.flatnonzero(counts).tolist(),
+                                      counts[counts > 0].tolist())})
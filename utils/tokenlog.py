@@ -0,0 +1,336 @@
+''' Compact binary log of the tokens of every parsed page.
+
+A log at PATH is three files:
+
+    PATH        header, then one record per page
+    PATH.words  the string table, one string per line; a string's id is its
+                line number. Urls and tokens share the table.
+    PATH.idx    the offset of every record in PATH, as 8-byte integers
+
+The header is MAGIC and a byte naming the compression. Each record is the
+varint length of its payload followed by the payload: the varints url id,
+token count and token ids, compressed on its own when the log is. Records
+only refer to strings that are already in PATH.words, so the log can be
+read while it is written and a crash loses at most the records still in the
+buffers.
+
+    python -m utils.tokenlog tokens.log [more logs] [--top 50] [--text]
+
+rebuilds most_common_words.txt and longest_page.txt from logs, or prints
+them in the old tokens.txt format. '''
+import os
+import sys
+import lzma
+import mmap
+import zlib
+import argparse
+
+from array import array
+from collections import Counter
+
+from utils.analytics import write_atomic
+
+MAGIC = b"TOKLOG1"
+HEADER_SIZE = len(MAGIC) + 1
+COMPRESSIONS = {
+    "none": (0, None, None),
+    "zlib": (1, zlib.compress, zlib.decompress),
+    "lzma": (2, lzma.compress, lzma.decompress)}
+COMPRESSION_NAMES = {code: name for name, (code, _, _) in COMPRESSIONS.items()}
+
+
+def encode_varints(values, out):
+    ''' Appends values to the bytearray out, 7 bits per byte. '''
+    for value in values:
+        while value > 0x7f:
+            out.append(value & 0x7f | 0x80)
+            value >>= 7
+        out.append(value)
+
+
+def decode_varint(data, pos):
+    ''' Returns the varint at data[pos] and the position after it. '''
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def decode_record(payload, decompress=None):
+    ''' Returns the url id and token ids of a record's payload. '''
+    if decompress:
+        payload = decompress(payload)
+    url_id, pos = decode_varint(payload, 0)
+    count, pos = decode_varint(payload, pos)
+    ids = array("I")
+    for _ in range(count):
+        token_id, pos = decode_varint(payload, pos)
+        ids.append(token_id)
+    return url_id, ids
+
+
+def _frame_at(data, pos):
+    ''' Returns the payload bounds of the record at pos, or None when the
+    record is cut short. '''
+    try:
+        length, start = decode_varint(data, pos)
+    except IndexError:
+        return None
+    if start + length > len(data):
+        return None
+    return start, start + length
+
+
+def read_header(file):
+    header = file.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE or header[:-1] != MAGIC:
+        raise ValueError(f"{file.name} is not a token log")
+    if header[-1] not in COMPRESSION_NAMES:
+        raise ValueError(f"{file.name} has unknown compression {header[-1]}")
+    return COMPRESSION_NAMES[header[-1]]
+
+
+def read_words(path):
+    ''' Returns the string table of the log at path. '''
+    try:
+        with open(path + ".words", "rb") as file:
+            data = file.read()
+    except FileNotFoundError:
+        return list()
+    # A line without its newline was cut short by a crash.
+    return data.decode("utf-8").split("\n")[:-1]
+
+
+def read_offsets(path):
+    ''' Returns the record offsets of the log at path. '''
+    offsets = array("Q")
+    try:
+        with open(path + ".idx", "rb") as file:
+            index = file.read()
+    except FileNotFoundError:
+        return offsets
+    # An offset without all of its bytes was cut short by a crash.
+    offsets.frombytes(index[:len(index) - len(index) % offsets.itemsize])
+    return offsets
+
+
+class TokenLogWriter(object):
+    ''' Appends pages to the token log at path, creating it with the given
+    compression ("none", "zlib" or "lzma"). An existing log keeps its own
+    compression; a record cut short by a crash is dropped on open. Writes
+    are buffered until buffer_size bytes of records are waiting, then the
+    new strings are written before the records that use them. Not thread
+    safe - the crawl state only calls write() from its writer thread. '''
+    def __init__(self, path, compression="none", buffer_size=1024 * 1024):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown token log compression {compression}")
+        self.path = path
+        self.words = read_words(path)
+        self.ids = {word: word_id for word_id, word in enumerate(self.words)}
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as file:
+                compression = read_header(file)
+            self._recover()
+            self.log = open(path, "ab")
+        else:
+            self.log = open(path, "wb")
+            self.log.write(MAGIC + bytes([COMPRESSIONS[compression][0]]))
+            open(path + ".idx", "wb").close()
+            open(path + ".words", "wb").close()
+        self.compress = COMPRESSIONS[compression][1]
+        self.buffer_size = buffer_size
+        self.offset = self.log.tell()
+        self.words_file = open(path + ".words", "ab")
+        self.index_file = open(path + ".idx", "ab")
+        self.pending_words = bytearray()
+        self.pending_records = bytearray()
+        self.pending_offsets = array("Q")
+
+    def _recover(self):
+        ''' Cuts the three files back to the last complete record. '''
+        with open(self.path + ".words", "a+b") as file:
+            file.seek(0)
+            file.truncate(file.read().rfind(b"\n") + 1)
+        offsets = read_offsets(self.path)
+        size = os.path.getsize(self.path)
+        while offsets and offsets[-1] >= size:
+            offsets.pop()
+        with open(self.path, "r+b") as file:
+            with mmap.mmap(file.fileno(), 0) as data:
+                pos = offsets.pop() if offsets else HEADER_SIZE
+                while True:
+                    frame = _frame_at(data, pos) if pos < size else None
+                    if frame is None:
+                        break
+                    offsets.append(pos)
+                    pos = frame[1]
+            file.truncate(pos)
+        with open(self.path + ".idx", "wb") as file:
+            offsets.tofile(file)
+
+    def _id(self, string):
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = self.ids[string] = len(self.words)
+            self.words.append(string)
+            self.pending_words += string.encode("utf-8") + b"\n"
+        return string_id
+
+    def write(self, url, tokens):
+        payload = bytearray()
+        encode_varints((self._id(url), len(tokens)), payload)
+        encode_varints([self._id(token) for token in tokens], payload)
+        if self.compress:
+            payload = self.compress(payload)
+        self.pending_offsets.append(self.offset + len(self.pending_records))
+        encode_varints((len(payload),), self.pending_records)
+        self.pending_records += payload
+        if len(self.pending_records) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        # Strings before the records that use them, records before their
+        # offsets.
+        for file, data in ((self.words_file, self.pending_words),
+                           (self.log, self.pending_records),
+                           (self.index_file, self.pending_offsets.tobytes())):
+            file.write(data)
+            file.flush()
+        self.offset += len(self.pending_records)
+        self.pending_words = bytearray()
+        self.pending_records = bytearray()
+        self.pending_offsets = array("Q")
+
+    def close(self):
+        self.flush()
+        self.words_file.close()
+        self.log.close()
+        self.index_file.close()
+
+
+class TokenLogReader(object):
+    ''' Streams the pages of the token log at path, in the order they were
+    written, reading chunk_size bytes at a time. Iterating yields
+    (url, tokens); records() yields the raw (url id, token ids). '''
+    def __init__(self, path, chunk_size=1024 * 1024):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.words = read_words(path)
+
+    def records(self):
+        with open(self.path, "rb") as file:
+            decompress = COMPRESSIONS[read_header(file)][2]
+            buffer = b""
+            pos = 0
+            while True:
+                frame = _frame_at(buffer, pos)
+                if frame is None:
+                    chunk = file.read(self.chunk_size)
+                    if not chunk:
+                        return
+                    buffer = buffer[pos:] + chunk
+                    pos = 0
+                    continue
+                start, pos = frame
+                yield decode_record(buffer[start:pos], decompress)
+
+    def __iter__(self):
+        words = self.words
+        for url_id, ids in self.records():
+            yield words[url_id], [words[token_id] for token_id in ids]
+
+
+class MappedTokenLog(object):
+    ''' Random access to the pages of the token log at path through a
+    memory map and its offset index: log[i] is the (url, tokens) of the
+    i-th page written. '''
+    def __init__(self, path):
+        self.words = read_words(path)
+        self.file = open(path, "rb")
+        self.decompress = COMPRESSIONS[read_header(self.file)][2]
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = read_offsets(path)
+        # The index may be ahead of the records that reached the disk.
+        while self.offsets and _frame_at(self.data, self.offsets[-1]) is None:
+            self.offsets.pop()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def record(self, index):
+        ''' Returns the url id and token ids of the index-th page. '''
+        start, end = _frame_at(self.data, self.offsets[index])
+        return decode_record(self.data[start:end], self.decompress)
+
+    def __getitem__(self, index):
+        url_id, ids = self.record(index)
+        return self.words[url_id], [self.words[token_id] for token_id in ids]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def rebuild_word_counts(paths, ignore=()):
+    ''' Exact word frequencies and the longest page of the given logs,
+    without the words in ignore. Near-duplicate pages were logged too, so
+    they are counted here, unlike in the crawl's own reports. '''
+    counts = Counter()
+    longest_page = {"url": "", "word_count": 0}
+    for path in paths:
+        reader = TokenLogReader(path)
+        # Every log has its own string table, so ids are counted per log.
+        id_counts = Counter()
+        for url_id, ids in reader.records():
+            id_counts.update(ids)
+            if len(ids) > longest_page["word_count"]:
+                longest_page["url"] = reader.words[url_id]
+                longest_page["word_count"] = len(ids)
+        for word_id, count in id_counts.items():
+            word = reader.words[word_id]
+            if word not in ignore:
+                counts[word] += count
+    return counts, longest_page
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Rebuild the word reports from token logs.")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--top", type=int, default=50)
+    parser.add_argument("--text", action="store_true", default=False,
+                        help="print the logs in the tokens.txt format")
+    args = parser.parse_args(args)
+    if args.text:
+        for path in args.paths:
+            for url, tokens in TokenLogReader(path):
+                sys.stdout.write(
+                    "URL: " + url + "\nTokens: "
+                    + "".join(token + ", " for token in tokens) + "\n")
+        return
+    from scraper import stop_words
+    counts, longest_page = rebuild_word_counts(args.paths, set(stop_words))
+    write_atomic("most_common_words.txt", [
+        word + ": " + str(count) + "\n"
+        for word, count in counts.most_common(args.top)])
+    write_atomic("longest_page.txt", [
+        "Longest Page: " + longest_page["url"] + "\n",
+        "Word Count: " + str(longest_page["word_count"])])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import re
+
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+
+class UrlPolicy(object):
+    ''' Crawl rules compiled once: allowed domain suffixes, query and path
+    substrings to deny, and file extensions to skip. Each url is parsed
+    once, and verdicts are kept in an LRU cache because the same links show
+    up on many pages. '''
+    def __init__(self, domains, denied_queries=(), denied_paths=(),
+                 extensions=(), schemes=("http", "https"), cache_size=1 << 18):
+        self.schemes = frozenset(schemes)
+        # A host is allowed if it is one of the domains or ends in
+        # "." + one of them.
+        self.domain_pattern = re.compile(
+            r"(?:^|\.)(?:%s)$" % "|".join(
+                re.escape(domain.strip(".")) for domain in domains))
+        self.query_pattern = self._substring_pattern(denied_queries)
+        self.path_pattern = self._substring_pattern(denied_paths)
+        self.extensions = frozenset(extensions)
+        self.is_valid = lru_cache(maxsize=cache_size)(self._evaluate)
+
+    @staticmethod
+    def _substring_pattern(substrings):
+        if not substrings:
+            return None
+        return re.compile("|".join(re.escape(s) for s in substrings))
+
+    def _evaluate(self, url):
+        try:
+            parsed = urlsplit(url)
+        except ValueError:
+            # e.g. an unbalanced "[" in the host
+            return False
+        if parsed.scheme not in self.schemes:
+            return False
+        # Same as parsed.hostname, without the property's overhead.
+        host = parsed.netloc.rpartition("@")[2].partition(":")[0].lower()
+        if not host or not self.domain_pattern.search(host):
+            return False
+        if self.query_pattern and self.query_pattern.search(parsed.query):
+            return False
+        path = parsed.path.partition(";")[0].lower()
+        if self.path_pattern and self.path_pattern.search(path):
+            return False
+        dot = path.rfind(".")
+        return dot < 0 or path[dot + 1:] not in self.extensions
+
+    def cache_info(self):
+        return self.is_valid.cache_info()